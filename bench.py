@@ -0,0 +1,316 @@
+# coding: utf-8
+
+u'''
+Reproducible benchmarks for the generators.
+
+    python bench.py [--datasets words,scrum] [--output result.json]
+                    [--baseline baseline.json] [--tolerance 0.2]
+                    [--repeat 5] [--min-time 1.0]
+
+Every word list is shuffled with the same seed, and the open-grid search
+stops after a fixed number of expanded nodes, so two runs do the same
+work.  Each measurement is repeated at least --repeat times and for at
+least --min-time seconds of CPU time, and the best run is reported.  With --baseline,
+timings more than tolerance worse than the baseline, and counts that
+differ from it at all, are reported and the exit status is 1.
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+try:
+    # CPU time of this process, so that other processes do not count
+    clock = time.process_time
+except AttributeError:
+    # Python 2, where clock is the CPU time on Unix
+    clock = time.clock
+
+import crossword
+import crossword2
+from crossword import *
+from wordindex import WordIndex, load_words
+
+DATASETS = ['words', 'words.short', 'words.all', 'scrum', 'kana']
+
+# nodes to expand in the open-grid search unless --nodes is given; the
+# first expansion on a large list already places hundreds of thousands
+# of candidates
+OPEN_NODES = {'words.short': 10, 'words.all': 1}
+DEFAULT_OPEN_NODES = 200
+
+# metrics where a larger value is better, and deterministic ones which
+# must not change at all
+HIGHER_IS_BETTER = set(['nodes_per_sec'])
+EXACT = set(['nodes', 'results', 'best_score', 'words', 'size'])
+
+
+def load_dataset(name, seed):
+    # the word lists are next to this file, wherever it is run from
+    words = load_words(os.path.join(os.path.dirname(os.path.abspath(__file__)), name))
+    random.Random(seed).shuffle(words)
+    return words
+
+
+def repeated(func, repeat, min_time):
+    u'''
+    Calls func at least repeat times and until min_time seconds of CPU
+    time have passed, returning its results.
+    '''
+    results = []
+    started = clock()
+    while len(results) < repeat or clock() - started < min_time:
+        results.append(func())
+    return results
+
+
+def summarize(runs):
+    u'''
+    Merges the metrics of repeated runs: the best value of the timings,
+    and the value of the deterministic metrics, which is the same in every
+    run.
+
+    >>> summarize([{'nodes': 5, 'elapsed': 2.0}, {'nodes': 5, 'elapsed': 1.0}]) == {'nodes': 5, 'elapsed': 1.0}
+    True
+    '''
+    merged = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs]
+        if metric in EXACT or None in values:
+            merged[metric] = values[0]
+        elif metric in HIGHER_IS_BETTER:
+            merged[metric] = max(values)
+        else:
+            merged[metric] = min(values)
+    return merged
+
+
+def per_call(func, items, repeat=3, min_time=0.0):
+    u'''
+    Best time over repeated rounds of calling func on every item, divided
+    by the number of items.
+    '''
+    def measure():
+        started = clock()
+        for item in items:
+            func(item)
+        return clock() - started
+    return min(repeated(measure, repeat, min_time)) / max(1, len(items))
+
+
+def search_open(words, nodes, target_score, copy_free):
+    budget = crossword2.SearchBudget(nodes=nodes)
+    started = clock()
+    first = target = None
+    best = None
+    for c in crossword2.build_crossword2(words, budget=budget, copy_free=copy_free):
+        elapsed = clock() - started
+        if first is None and len(c.used_words) > 1:
+            first = elapsed
+        score = crossword2.evaluate_crossword(c)
+        if best is None or score < best:
+            best = score
+        if target is None and score <= target_score:
+            target = elapsed
+    elapsed = clock() - started
+    return {
+        'nodes': budget.expanded,
+        'nodes_per_sec': budget.expanded / elapsed if elapsed > 0 else 0.0,
+        'time_to_first': first,
+        'time_to_target': target,
+        'best_score': best,
+        'elapsed': elapsed,
+    }
+
+
+def peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_open(words, nodes, args):
+    result = summarize(repeated(lambda: search_open(words, nodes, args.target, args.copy_free),
+                                args.repeat, args.min_time))
+    if args.memory and tracemalloc is not None:
+        result['peak_memory'] = peak_memory(search_open, words, nodes, args.target, args.copy_free)
+    return result
+
+
+def bench_fixed(words, args):
+    return summarize(repeated(lambda: search_fixed(words, args), args.repeat, args.min_time))
+
+
+def search_fixed(words, args):
+    size = args.fixed_size
+    fixed_words = [w for w in words if len(w) <= size][:args.fixed_words]
+    started = clock()
+    results = crossword.build_crossword(size, size, fixed_words)
+    elapsed = clock() - started
+    started = clock()
+    for _ in crossword.solve_crossword(size, size, fixed_words, unique=True, limit=1):
+        pass
+    first = clock() - started
+    return {
+        'words': len(fixed_words),
+        'size': size,
+        'results': len(results),
+        'elapsed': elapsed,
+        'time_to_first': first,
+    }
+
+
+def sample_patterns(words, rng, count):
+    patterns = []
+    for _ in range(count):
+        word = rng.choice(words)
+        start = rng.randrange(len(word))
+        end = rng.randrange(start, len(word)) + 1
+        patterns.append(''.join(c if i == 0 or rng.random() < 0.5 else '.'
+                                for i, c in enumerate(word[start:end])))
+    return patterns
+
+
+def sample_lines(words, rng, count, length=40):
+    letters = ''.join(words)
+    lines = []
+    for _ in range(count):
+        cells = [rng.choice([EMPTY, EMPTY, FILLED, rng.choice(letters)]) for _ in range(length)]
+        lines.append(''.join(cells))
+    return lines
+
+
+def bench_helpers(words, args):
+    rng = random.Random(args.seed)
+    index = WordIndex(words)
+    patterns = sample_patterns(words, rng, 50)
+    sequences = [((0, 0), HORIZONTAL, p) for p in patterns]
+    lines = sample_lines(words, rng, 200)
+    c2 = crossword2.Crossword2()
+    poslist = [(0, i) for i in range(len(lines[0]))]
+    fixed_words = [w for w in words if len(w) <= 8][:20] or words[:20]
+    c = Crossword(8, 8)
+    for word in fixed_words:
+        fits = find_all_fit(c, word)
+        if fits:
+            r, col, d = fits[rng.randrange(len(fits))]
+            c.embed((r, col), d, word)
+        if len(fits) < 4: break
+    positions = list(c.allpos())
+    fit_words = fixed_words[:5]
+    repeat, min_time = args.repeat, args.min_time
+    return {
+        'propose_words': per_call(lambda s: crossword2.propose_words(s, index), sequences,
+                                  repeat, min_time),
+        'extract_sequences': per_call(lambda l: c2.extract_sequences(l, poslist, HORIZONTAL), lines,
+                                      repeat, min_time),
+        'is_fit': per_call(lambda p: c.is_fit(p, HORIZONTAL, fit_words[0]), positions,
+                           repeat, min_time),
+        'find_all_fit': per_call(lambda w: find_all_fit(c, w), fit_words, repeat, min_time),
+    }
+
+
+def run_benchmarks(args):
+    results = {'seed': args.seed, 'copy_free': args.copy_free, 'datasets': {}}
+    for name in args.datasets:
+        words = load_dataset(name, args.seed)
+        nodes = args.nodes or OPEN_NODES.get(name, DEFAULT_OPEN_NODES)
+        results['datasets'][name] = {
+            'helpers': bench_helpers(words, args),
+            'fixed': bench_fixed(words, args),
+            'open': bench_open(words, nodes, args),
+        }
+        if args.verbose:
+            print (json.dumps({name: results['datasets'][name]}, indent=1, sort_keys=True))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    u'''
+    Lists the metrics which got worse than the baseline by more than
+    tolerance, and the deterministic ones which changed.
+
+    >>> old = {'datasets': {'w': {'open': {'nodes_per_sec': 100.0, 'elapsed': 1.0, 'nodes': 9}}}}
+    >>> new = {'datasets': {'w': {'open': {'nodes_per_sec': 70.0, 'elapsed': 1.1, 'nodes': 8}}}}
+    >>> compare(new, old, 0.2)
+    [('w', 'open', 'nodes', 9, 8), ('w', 'open', 'nodes_per_sec', 100.0, 70.0)]
+    '''
+    regressions = []
+    for name, cases in sorted(results['datasets'].items()):
+        for case, metrics in sorted(cases.items()):
+            old_metrics = baseline.get('datasets', {}).get(name, {}).get(case, {})
+            for metric, value in sorted(metrics.items()):
+                old = old_metrics.get(metric)
+                if metric in EXACT:
+                    if metric in old_metrics and value != old:
+                        regressions.append((name, case, metric, old, value))
+                    continue
+                if not value or not old:
+                    continue
+                if metric in HIGHER_IS_BETTER:
+                    worse = value < old * (1 - tolerance)
+                else:
+                    worse = value > old * (1 + tolerance)
+                if worse:
+                    regressions.append((name, case, metric, old, value))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='benchmark the crossword generators')
+    parser.add_argument('--datasets', default=','.join(DATASETS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nodes', type=int,
+                        help='nodes to expand in the open-grid search')
+    parser.add_argument('--copy', dest='copy_free', action='store_false',
+                        help='run the open-grid search copying every candidate')
+    parser.add_argument('--target', type=float, default=1.0,
+                        help='score to reach in the open-grid search')
+    parser.add_argument('--fixed-words', type=int, default=3,
+                        help='words to place in the fixed-grid search')
+    parser.add_argument('--fixed-size', type=int, default=5,
+                        help='width and height of the fixed grid')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the peak memory measurement')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='times to repeat each measurement at least')
+    parser.add_argument('--min-time', type=float, default=1.0,
+                        help='seconds to repeat each measurement at least')
+    parser.add_argument('--output')
+    parser.add_argument('--baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    args.datasets = args.datasets.split(',')
+
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    else:
+        print (json.dumps(results, indent=1, sort_keys=True))
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, case, metric, old, new in regressions:
+            print ('regression: %s %s %s %s -> %s'%(name, case, metric, old, new))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,9 @@
+# coding: utf-8
+
+import sys
+from codecs import open
+
+from wordindex import compile_words
+
+with open(sys.argv[1], encoding='utf-8') as f:
+    compile_words(f.readlines(), sys.argv[2])
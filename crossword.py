@@ -1,5 +1,11 @@
 # encoding: utf-8
 
+import hashlib
+import re
+from array import array
+
+from searchstats import NULL_STATS
+
 FILLED = '#'
 EMPTY = '_'
 VERTICAL = 1
@@ -10,25 +16,111 @@ class OpenGrid(object):
 
     def __init__(self):
         self.cells = {}
-        self.stale = True
+        self.links = {}
+        self._colmin = self._colmax = self._rowmin = self._rowmax = 0
+        self.stale = False
 
     def copy(self):
         copied = OpenGrid()
         copied.cells = self.cells.copy()
-        copied.stale = True
+        copied.links = self.links.copy()
+        copied._rowmin, copied._colmin = self._rowmin, self._colmin
+        copied._rowmax, copied._colmax = self._rowmax, self._colmax
+        copied.stale = self.stale
         return copied
 
     def set(self, pos, value):
+        u'''
+        Sets a cell.  The covered area only grows here, so it is updated
+        in place; erase makes it stale.
+
+        >>> g = OpenGrid()
+        >>> g.set((2, -1), u'A')
+        >>> g.set((0, 3), u'B')
+        >>> g.rowmin, g.colmin, g.rowmax, g.colmax
+        (0, -1, 2, 3)
+        '''
         assert self.get(pos) == value or pos not in self.cells
         if value == EMPTY: return
         self.cells[pos] = value
-        self.stale = True
+        if self.stale: return
+        row, col = pos
+        if len(self.cells) == 1:
+            self._rowmin = self._rowmax = row
+            self._colmin = self._colmax = col
+        else:
+            if row < self._rowmin: self._rowmin = row
+            elif row > self._rowmax: self._rowmax = row
+            if col < self._colmin: self._colmin = col
+            elif col > self._colmax: self._colmax = col
 
     def get(self, pos):
         if pos in self.cells:
             return self.cells[pos]
         return EMPTY
 
+    def erase(self, pos):
+        del self.cells[pos]
+        self.links.pop(pos, None)
+        self.stale = True
+
+    def is_linked(self, pos, direction):
+        u'''
+        Whether the cell at pos and the next one in direction are letters
+        of one word.  Each cell keeps the directions it is linked in as
+        bit flags.
+
+        >>> g = OpenGrid()
+        >>> g.link((0, 0), HORIZONTAL)
+        >>> g.is_linked((0, 0), HORIZONTAL), g.is_linked((0, 0), VERTICAL)
+        (True, False)
+        >>> g.unlink((0, 0), HORIZONTAL)
+        >>> g.is_linked((0, 0), HORIZONTAL)
+        False
+        '''
+        return bool(self.links.get(pos, 0) & direction)
+
+    def link(self, pos, direction):
+        self.links[pos] = self.links.get(pos, 0) | direction
+
+    def fits(self, pos, direction, word):
+        u'''
+        Whether word can be written from pos: the cells before and after it
+        hold no letter, its cells are empty or have the same letters, and
+        no two of them are already linked, see Crossword.is_fit.
+        '''
+        before = self.get(Grid.pos_inc(pos, -1, direction))
+        if before != EMPTY and before != FILLED:
+            return False
+        after = self.get(Grid.pos_inc(pos, len(word), direction))
+        if after != EMPTY and after != FILLED:
+            return False
+        old_p = None
+        for i, p in enumerate(self.poslist(pos, direction, len(word))):
+            value = self.get(p)
+            if value != EMPTY and word[i] != value:
+                return False
+            if i > 0:
+                if self.is_linked(old_p, direction):
+                    return False
+            old_p = p
+        return True
+
+    def unlink(self, pos, direction):
+        flags = self.links.get(pos, 0) & ~direction
+        if flags:
+            self.links[pos] = flags
+        else:
+            self.links.pop(pos, None)
+
+    def save_area(self):
+        self.refresh_covered_area()
+        return (self._rowmin, self._colmin, self._rowmax, self._colmax)
+
+    def restore_area(self, area):
+        self._rowmin, self._colmin, self._rowmax, self._colmax = area
+        self.stale = False
+
     @staticmethod
     def pos_inc(pos, increment, direction):
         row, col = pos
@@ -98,18 +190,37 @@ class OpenGrid(object):
         self.cells = dict(((r, c), self.cells[(r, c)])
                           for (r, c) in self.cells
                           if c != col)
+        self.links = dict(((r, c), flags) for (r, c), flags in self.links.items() if c != col)
         self.stale = True
 
     def delete_row(self, row):
         self.cells = dict(((r, c), self.cells[(r, c)])
                           for (r, c) in self.cells
                           if r != row)
+        self.links = dict(((r, c), flags) for (r, c), flags in self.links.items() if r != row)
         self.stale = True
 
     def fill_all_empty(self):
-        for pos in self.allpos():
-            if self.get(pos) == EMPTY:
-                self.set(pos, FILLED)
+        self.crop(self.rowmin, self.colmin, self.rowmax, self.colmax, fill=True)
+
+    def crop(self, rowmin, colmin, rowmax, colmax, fill=False):
+        u'''
+        Keeps only the cells in the rectangle.  With fill, its empty cells
+        become FILLED and it is the covered area.
+        '''
+        cells = self.cells
+        if fill:
+            self.cells = dict(((r, c), cells.get((r, c), FILLED))
+                              for r in range(rowmin, rowmax + 1)
+                              for c in range(colmin, colmax + 1))
+            self.restore_area((rowmin, colmin, rowmax, colmax))
+        else:
+            self.cells = dict(((r, c), v) for (r, c), v in cells.items()
+                              if rowmin <= r <= rowmax and colmin <= c <= colmax)
+            self.stale = True
+
+    def letter_positions(self):
+        return [pos for pos, v in self.cells.items() if v != FILLED]
 
     def dump(self, empty=None, filled=None):
         if not empty: empty = EMPTY
@@ -140,58 +251,345 @@ class OpenGrid(object):
         #X#
         ###
         '''
-        self.shrink_right()
-        self.shrink_left()
-        self.shrink_top()
-        self.shrink_bottom()
-
-    def shrink_right(self):
-        while True:
-            if (FILLED * self.height ==
-               self.get_col(self.colmin) ==
-               self.get_col(self.colmin + 1)):
-                self.delete_col(self.colmin)
-            elif (EMPTY * self.height ==
-                  self.get_col(self.colmin)):
-                self.delete_col(self.colmin)
-            else:
-                break
+        rowmin, colmin, rowmax, colmax = self.rowmin, self.colmin, self.rowmax, self.colmax
+        # drop the outer one of two FILLED lines, and empty lines; the
+        # columns first, then the rows between the columns left
+        height = rowmax - rowmin + 1
+        col = lambda c: self.get_word((rowmin, c), VERTICAL, height)
+        while colmin < colmax and is_trimmable(col(colmin), col(colmin + 1)):
+            colmin += 1
+        while colmin < colmax and is_trimmable(col(colmax), col(colmax - 1)):
+            colmax -= 1
+        width = colmax - colmin + 1
+        row = lambda r: self.get_word((r, colmin), HORIZONTAL, width)
+        while rowmin < rowmax and is_trimmable(row(rowmin), row(rowmin + 1)):
+            rowmin += 1
+        while rowmin < rowmax and is_trimmable(row(rowmax), row(rowmax - 1)):
+            rowmax -= 1
+        self.crop(rowmin, colmin, rowmax, colmax)
 
-    def shrink_left(self):
-        while True:
-            if (FILLED * self.height ==
-               self.get_col(self.colmax) ==
-               self.get_col(self.colmax - 1)):
-                self.delete_col(self.colmax)
-            elif (EMPTY * self.height ==
-                  self.get_col(self.colmax)):
-                self.delete_col(self.colmax)
-            else:
-                break
+    def fill_and_shrink(self):
+        u'''
+        fill_all_empty followed by shrink, rebuilding the grid once.  After
+        filling, a line is FILLED unless it has a letter.
 
-    def shrink_top(self):
-        while True:
-            if (FILLED * self.width ==
-               self.get_row(self.rowmin) ==
-               self.get_row(self.rowmin + 1)):
-                self.delete_row(self.rowmin)
-            elif (EMPTY * self.width ==
-                  self.get_row(self.rowmin)):
-                self.delete_row(self.rowmin)
-            else:
-                break
+        >>> g = Grid(4, 3)
+        >>> g.set((1, 1), u'X')
+        >>> g.fill_and_shrink()
+        >>> g.dump()
+        ###
+        #X#
+        ###
+        '''
+        rows = set()
+        cols = set()
+        for r, c in self.letter_positions():
+            rows.add(r)
+            cols.add(c)
+        rowmin, colmin, rowmax, colmax = self.rowmin, self.colmin, self.rowmax, self.colmax
+        while colmin < colmax and colmin not in cols and colmin + 1 not in cols:
+            colmin += 1
+        while colmin < colmax and colmax not in cols and colmax - 1 not in cols:
+            colmax -= 1
+        while rowmin < rowmax and rowmin not in rows and rowmin + 1 not in rows:
+            rowmin += 1
+        while rowmin < rowmax and rowmax not in rows and rowmax - 1 not in rows:
+            rowmax -= 1
+        self.crop(rowmin, colmin, rowmax, colmax, fill=True)
+
+
+def is_trimmable(line, inner):
+    return line == inner == FILLED * len(line) or line == EMPTY * len(line)
+
+
+class OpenArrayGrid(OpenGrid):
+
+    u'''
+    OpenGrid backed by a flat list of cells, row by row.
+
+    The list covers a rectangle whose top left cell is at (``top``,
+    ``left``) and grows on demand.  The cells hold the characters
+    themselves, so reading them needs no decoding.  The covered area is
+    kept up to date on every set.
+
+    >>> g = OpenArrayGrid()
+    >>> g.set((0, 0), u'A')
+    >>> g.set((-3, 2), u'B')
+    >>> g.set((1, 5), FILLED)
+    >>> g.rowmin, g.colmin, g.rowmax, g.colmax
+    (-3, 0, 1, 5)
+    >>> print (g.get_row(0) + ' ' + g.get_col(2))
+    A_____ B____
+    >>> h = g.copy()
+    >>> h.set((0, 1), u'X')
+    >>> g.dump()
+    __B___
+    ______
+    ______
+    A_____
+    _____#
+    >>> print (h.get_row(0))
+    AX____
+    '''
+
+    MARGIN = 2
+
+    def __init__(self):
+        self.top = self.left = 0
+        self.rows = 0
+        self.cols = 0
+        self.buffer = []
+        self.links = array('B')
+        self.stale = False
+        self.blank = True
+        self._colmin = self._colmax = self._rowmin = self._rowmax = 0
+
+    def copy(self):
+        copied = self.__class__.__new__(self.__class__)
+        copied.__dict__.update(self.__dict__)
+        copied.buffer = self.buffer[:]
+        copied.links = array('B', self.links)
+        return copied
+
+    def index(self, pos):
+        row, col = pos
+        i = row - self.top
+        j = col - self.left
+        if 0 <= i < self.rows and 0 <= j < self.cols:
+            return i * self.cols + j
+        return -1
+
+    def grow(self, pos):
+        row, col = pos
+        if not self.rows:
+            rowmin = rowmax = row
+            colmin = colmax = col
+        else:
+            rowmin, colmin = self.top, self.left
+            rowmax = rowmin + self.rows - 1
+            colmax = colmin + self.cols - 1
+        if row < rowmin: rowmin = row - max(self.MARGIN, self.rows // 4)
+        if row > rowmax: rowmax = row + max(self.MARGIN, self.rows // 4)
+        if col < colmin: colmin = col - max(self.MARGIN, self.cols // 4)
+        if col > colmax: colmax = col + max(self.MARGIN, self.cols // 4)
+        self.reserve(rowmin, colmin, rowmax, colmax)
+
+    def reserve(self, rowmin, colmin, rowmax, colmax):
+        u'''
+        Makes the buffer cover the rectangle, without margins when it
+        grows, so that a grid of known size is allocated once.
+        '''
+        if self.rows:
+            rowmin = min(rowmin, self.top)
+            colmin = min(colmin, self.left)
+            rowmax = max(rowmax, self.top + self.rows - 1)
+            colmax = max(colmax, self.left + self.cols - 1)
+        rows = rowmax - rowmin + 1
+        cols = colmax - colmin + 1
+        if (rows, cols) == (self.rows, self.cols): return
+        top = self.top - rowmin if self.rows else 0
+        bottom = rows - top - self.rows
+        if cols == self.cols:
+            buffer = self.buffer
+            links = self.links
+        else:
+            # pad every row on both sides
+            left = [EMPTY] * (self.left - colmin if self.rows else 0)
+            right = [EMPTY] * (cols - len(left) - self.cols)
+            buffer = []
+            links = array('B')
+            left_links = array('B', [0]) * len(left)
+            right_links = array('B', [0]) * len(right)
+            for i in range(self.rows):
+                start = i * self.cols
+                buffer += left
+                buffer += self.buffer[start:start + self.cols]
+                buffer += right
+                links += left_links
+                links += self.links[start:start + self.cols]
+                links += right_links
+        self.top, self.left = rowmin, colmin
+        self.rows = rows
+        self.cols = cols
+        self.buffer = [EMPTY] * (top * cols) + buffer + [EMPTY] * (bottom * cols)
+        self.links = array('B', [0]) * (top * cols) + links + array('B', [0]) * (bottom * cols)
+
+    def set(self, pos, value):
+        if value == EMPTY: return
+        row, col = pos
+        i = row - self.top
+        j = col - self.left
+        if 0 <= i < self.rows and 0 <= j < self.cols:
+            idx = i * self.cols + j
+        else:
+            self.grow(pos)
+            idx = self.index(pos)
+        assert self.buffer[idx] in (value, EMPTY)
+        self.buffer[idx] = value
+        if self.blank:
+            self._rowmin = self._rowmax = row
+            self._colmin = self._colmax = col
+            self.blank = False
+        else:
+            if row < self._rowmin: self._rowmin = row
+            if row > self._rowmax: self._rowmax = row
+            if col < self._colmin: self._colmin = col
+            if col > self._colmax: self._colmax = col
 
-    def shrink_bottom(self):
-        while True:
-            if (FILLED * self.width ==
-               self.get_row(self.rowmax) ==
-               self.get_row(self.rowmax - 1)):
-                self.delete_row(self.rowmax)
-            elif (EMPTY * self.width ==
-                  self.get_row(self.rowmax)):
-                self.delete_row(self.rowmax)
+    def get(self, pos):
+        row, col = pos
+        i = row - self.top
+        j = col - self.left
+        if 0 <= i < self.rows and 0 <= j < self.cols:
+            return self.buffer[i * self.cols + j]
+        return EMPTY
+
+    def is_empty(self, pos):
+        row, col = pos
+        i = row - self.top
+        j = col - self.left
+        return not (0 <= i < self.rows and 0 <= j < self.cols) or self.buffer[i * self.cols + j] == EMPTY
+
+    def erase(self, pos):
+        idx = self.index(pos)
+        self.buffer[idx] = EMPTY
+        self.links[idx] = 0
+        self.stale = True
+
+    def is_linked(self, pos, direction):
+        row, col = pos
+        i = row - self.top
+        j = col - self.left
+        if 0 <= i < self.rows and 0 <= j < self.cols:
+            return bool(self.links[i * self.cols + j] & direction)
+        return False
+
+    def link(self, pos, direction):
+        idx = self.index(pos)
+        self.links[idx] |= direction
+
+    def fits(self, pos, direction, word):
+        # cell k of the line is the k-th from the one before the word; the
+        # cells outside the buffer are empty and not linked
+        length = len(word)
+        i = pos[0] - self.top
+        j = pos[1] - self.left
+        if direction == HORIZONTAL:
+            if not 0 <= i < self.rows: return True
+            first, size, step, start = j - 1, self.cols, 1, i * self.cols
+        else:
+            if not 0 <= j < self.cols: return True
+            first, size, step, start = i - 1, self.rows, self.cols, j
+        lo = max(0, -first)
+        hi = min(length + 2, size - first)
+        if lo >= hi: return True
+        start += (first + lo) * step
+        stop = start + (hi - lo) * step
+        line = self.buffer[start:stop:step]
+        if lo == 0 and line[0] != EMPTY and line[0] != FILLED:
+            return False
+        if hi == length + 2 and line[-1] != EMPTY and line[-1] != FILLED:
+            return False
+        for k in range(max(lo, 1), min(hi, length + 1)):
+            value = line[k - lo]
+            if value != EMPTY and value != word[k - 1]:
+                return False
+        for flags in self.links[start:stop:step][max(lo, 1) - lo:min(hi, length) - lo]:
+            if flags & direction:
+                return False
+        return True
+
+    def unlink(self, pos, direction):
+        idx = self.index(pos)
+        self.links[idx] &= ~direction
+
+    def save_area(self):
+        self.refresh_covered_area()
+        return (self._rowmin, self._colmin, self._rowmax, self._colmax, self.blank)
+
+    def restore_area(self, area):
+        self._rowmin, self._colmin, self._rowmax, self._colmax, self.blank = area
+        self.stale = False
+
+    def get_word(self, pos, direction, length):
+        start = self.index(pos)
+        end = self.index(Grid.pos_inc(pos, length - 1, direction))
+        if start < 0 or end < 0:
+            return super(OpenArrayGrid, self).get_word(pos, direction, length)
+        step = 1 if direction == HORIZONTAL else self.cols
+        return ''.join(self.buffer[start:end + 1:step])
+
+    def refresh_covered_area(self):
+        if not self.stale: return
+        self.blank = True
+        self._colmin = self._colmax = self._rowmin = self._rowmax = 0
+        for idx, value in enumerate(self.buffer):
+            if value == EMPTY: continue
+            i, j = divmod(idx, self.cols)
+            row, col = i + self.top, j + self.left
+            if self.blank:
+                self._rowmin = self._rowmax = row
+                self._colmin = self._colmax = col
+                self.blank = False
             else:
-                break
+                self._rowmin = min(self._rowmin, row)
+                self._rowmax = max(self._rowmax, row)
+                self._colmin = min(self._colmin, col)
+                self._colmax = max(self._colmax, col)
+        self.stale = False
+
+    def delete_col(self, col):
+        u'''
+        Erases the letters and the links of a column, as erase does.
+
+        >>> g = OpenArrayGrid()
+        >>> for p in [(0, 0), (0, 1)]: g.set(p, u'A')
+        >>> g.link((0, 1), VERTICAL)
+        >>> g.delete_col(1)
+        >>> g.get((0, 1)), g.is_linked((0, 1), VERTICAL)
+        ('_', False)
+        '''
+        for row in range(self.top, self.top + self.rows):
+            idx = self.index((row, col))
+            if idx >= 0:
+                self.buffer[idx] = EMPTY
+                self.links[idx] = 0
+        self.stale = True
+
+    def crop(self, rowmin, colmin, rowmax, colmax, fill=False):
+        self.reserve(rowmin, colmin, rowmax, colmax)
+        cols = colmax - colmin + 1
+        buffer = []
+        links = array('B')
+        start = self.index((rowmin, colmin))
+        for row in range(rowmin, rowmax + 1):
+            buffer.extend(self.buffer[start:start + cols])
+            links.extend(self.links[start:start + cols])
+            start += self.cols
+        if fill:
+            buffer = [FILLED if value == EMPTY else value for value in buffer]
+        self.top, self.left = rowmin, colmin
+        self.rows = rowmax - rowmin + 1
+        self.cols = cols
+        self.buffer = buffer
+        self.links = links
+        if fill:
+            self.restore_area((rowmin, colmin, rowmax, colmax, False))
+        else:
+            self.stale = True
+
+    def letter_positions(self):
+        rowmin, colmin = self.top, self.left
+        return [(idx // self.cols + rowmin, idx % self.cols + colmin)
+                for idx in (m.start() for m in LETTER.finditer(''.join(self.buffer)))]
+
+    def delete_row(self, row):
+        for col in range(self.left, self.left + self.cols):
+            idx = self.index((row, col))
+            if idx >= 0:
+                self.buffer[idx] = EMPTY
+                self.links[idx] = 0
+        self.stale = True
 
 
 class Grid(OpenGrid):
@@ -228,11 +626,98 @@ class Grid(OpenGrid):
             self.set((rowmax, col), FILLED)
 
 
+class ArrayGrid(Grid, OpenArrayGrid):
+
+    u'''
+    Grid backed by an OpenArrayGrid.
+
+    >>> grid = ArrayGrid(3, 2)
+    >>> grid.set((1, 1), u'X')
+    >>> grid.fill_all_empty()
+    >>> grid.shrink()
+    >>> grid.dump()
+    ###
+    #X#
+    ###
+    '''
+
+    def fill_wall(self, rowmin, colmin, rowmax, colmax):
+        self.reserve(rowmin, colmin, rowmax, colmax)
+        super(ArrayGrid, self).fill_wall(rowmin, colmin, rowmax, colmax)
+
+
+HASH_MASK = (1 << 64) - 1
+HASH_ROW = 0x9E3779B97F4A7C15
+HASH_COL = 0xC2B2AE3D27D4EB4F
+
+
+def hash_inverse(a):
+    u'''
+    Multiplicative inverse of an odd number modulo 2 ** 64.
+
+    >>> HASH_ROW * hash_inverse(HASH_ROW) & HASH_MASK == 1
+    True
+    '''
+    x = a
+    for _ in range(6):
+        x = x * (2 - a * x) & HASH_MASK
+    return x
+
+HASH_ROW_INV = hash_inverse(HASH_ROW)
+HASH_COL_INV = hash_inverse(HASH_COL)
+
+_hash_keys = {}
+
+
+def hash_key(value):
+    u'''
+    Random looking 64 bit key for a cell value, stable across processes.
+    '''
+    if value not in _hash_keys:
+        digest = hashlib.md5(value.encode('utf-8')).hexdigest()
+        _hash_keys[value] = int(digest[:16], 16)
+    return _hash_keys[value]
+
+
+def hash_power(base, inverse, exponent):
+    if exponent < 0:
+        return pow(inverse, -exponent, HASH_MASK + 1)
+    return pow(base, exponent, HASH_MASK + 1)
+
+
+_hash_positions = {}
+
+
+def hash_position(pos):
+    u'''
+    HASH_ROW ** row * HASH_COL ** col, worked out once for each position.
+    '''
+    if pos not in _hash_positions:
+        row, col = pos
+        _hash_positions[pos] = (hash_power(HASH_ROW, HASH_ROW_INV, row) *
+                                hash_power(HASH_COL, HASH_COL_INV, col)) & HASH_MASK
+    return _hash_positions[pos]
+
+
+def hash_term(pos, value):
+    u'''
+    Zobrist style term of a value at a position.  Terms are summed, and
+    moving a layout by (dr, dc) multiplies the sum by HASH_ROW ** dr *
+    HASH_COL ** dc, which layout_key divides out again.
+    '''
+    return hash_key(value) * hash_position(pos) & HASH_MASK
+
+
+LINK_KEYS = {HORIZONTAL: u'link:H', VERTICAL: u'link:V'}
+
+
 class Crossword(object):
 
-    def __init__(self, width, height):
-        self.grid = Grid(width, height)
-        self.connected = {}
+    def __init__(self, width, height, grid_class=Grid):
+        self.grid = grid_class(width, height)
+        self.grid_class = grid_class
+        self.layout_hash = 0
+        self.other_links = None
 
     def allpos(self):
         return self.grid.allpos()
@@ -241,9 +726,12 @@ class Crossword(object):
         return self.grid.dump(*args, **argv)
 
     def copy(self):
-        copied = Crossword(self.grid.width, self.grid.height)
+        # the grid is copied, so the walls need not be built again
+        copied = Crossword.__new__(Crossword)
+        copied.grid_class = self.grid_class
         copied.grid = self.grid.copy()
-        copied.connected = self.connected.copy()
+        copied.layout_hash = self.layout_hash
+        copied.other_links = None if self.other_links is None else self.other_links.copy()
         return copied
 
     def get(self, pos):
@@ -255,11 +743,66 @@ class Crossword(object):
     def is_embedded(self, pos):
         return not(self.is_empty(pos) or self.get(pos) == FILLED)
 
+    @staticmethod
+    def link_of(pos1, pos2):
+        u'''
+        The direction from pos1 to pos2 if pos2 is the next cell, which is
+        how embed connects the letters of a word, or None.
+        '''
+        (r1, c1), (r2, c2) = pos1, pos2
+        if r1 == r2 and c2 == c1 + 1: return HORIZONTAL
+        if c1 == c2 and r2 == r1 + 1: return VERTICAL
+        return None
+
     def is_connected(self, pos1, pos2):
-        return (pos1, pos2) in self.connected
+        u'''
+        Whether pos1 and pos2 were connected, in this order.  The grid
+        keeps the links of embed as flags of their first cell, and the
+        other pairs given to connect are kept in other_links.
+
+        >>> c = Crossword(3, 3)
+        >>> c.embed((0, 0), HORIZONTAL, u'ANT')
+        >>> c.is_connected((0, 0), (0, 1)), c.is_connected((0, 1), (0, 0))
+        (True, False)
+        >>> c.is_connected((0, 0), (1, 0)), c.is_connected((0, 0), (0, 2))
+        (False, False)
+        '''
+        direction = self.link_of(pos1, pos2)
+        if direction is not None and self.grid.is_linked(pos1, direction):
+            return True
+        return self.other_links is not None and (pos1, pos2) in self.other_links
 
     def connect(self, pos1, pos2):
-        self.connected[(pos1, pos2)] = True
+        u'''
+        >>> c = Crossword(3, 3)
+        >>> c.connect((0, 0), (1, 0))
+        >>> c.connect((0, 0), (1, 1))
+        >>> c.is_connected((0, 0), (1, 0)), c.is_connected((0, 0), (1, 1))
+        (True, True)
+        >>> sorted(c.connected)
+        [((0, 0), (1, 0)), ((0, 0), (1, 1))]
+        '''
+        direction = self.link_of(pos1, pos2)
+        if direction is not None:
+            self.grid.link(pos1, direction)
+        else:
+            if self.other_links is None:
+                self.other_links = {}
+            self.other_links[(pos1, pos2)] = True
+
+    @property
+    def connected(self):
+        u'''
+        Every connected pair as the keys of a dict, made on each access.
+        '''
+        connected = {}
+        for pos in self.grid.allpos():
+            for direction in (HORIZONTAL, VERTICAL):
+                if self.grid.is_linked(pos, direction):
+                    connected[(pos, Grid.pos_inc(pos, 1, direction))] = True
+        if self.other_links is not None:
+            connected.update(self.other_links)
+        return connected
 
     def is_fit(self, pos, direction, word):
         u'''
@@ -290,19 +833,7 @@ class Crossword(object):
         >>> c.is_fit((1, 0), VERTICAL, u'IN')
         False
         '''
-        if self.is_embedded(Grid.pos_inc(pos, -1, direction)):
-            return False
-        if self.is_embedded(Grid.pos_inc(pos, len(word), direction)):
-            return False
-        old_p = None
-        for i, p in enumerate(self.grid.poslist(pos, direction, len(word))):
-            if not self.is_empty(p) and word[i] != self.get(p):
-                return False
-            if i > 0:
-                if self.is_connected(old_p, p):
-                    return False
-            old_p = p
-        return True
+        return self.grid.fits(pos, direction, word)
 
     def embed(self, pos, direction, word):
         u'''
@@ -321,35 +852,81 @@ class Crossword(object):
         '''
         old_p = None
         for i, p in enumerate(self.grid.poslist(pos, direction, len(word))):
-            self.grid.set(p, word[i])
-            if i > 0:
-                self.connect(old_p, p)
+            self.set_cell(p, word[i])
+            if i > 0 and not self.grid.is_linked(old_p, direction):
+                self.grid.link(old_p, direction)
+                self.layout_hash = (self.layout_hash + hash_term(old_p, LINK_KEYS[direction])) & HASH_MASK
             old_p = p
-        self.grid.set(Grid.pos_inc(pos, -1, direction), FILLED)
-        self.grid.set(Grid.pos_inc(pos, len(word), direction), FILLED)
+        self.set_cell(Grid.pos_inc(pos, -1, direction), FILLED)
+        self.set_cell(Grid.pos_inc(pos, len(word), direction), FILLED)
+
+    def set_cell(self, pos, value):
+        if self.grid.is_empty(pos):
+            self.layout_hash = (self.layout_hash + hash_term(pos, value)) & HASH_MASK
+        self.grid.set(pos, value)
+
+    def layout_key(self):
+        u'''
+        Hash of the embedded letters, end caps and connections, normalized
+        so that the same layout gets the same key wherever it is placed.
+
+        >>> a = Crossword(5, 5)
+        >>> a.embed((0, 0), HORIZONTAL, u'ANT')
+        >>> b = Crossword(5, 5)
+        >>> b.embed((0, 0), VERTICAL, u'ANT')
+        >>> a.layout_key() == b.layout_key()
+        False
+        >>> a.embed((0, 0), VERTICAL, u'ALL')
+        >>> b.embed((0, 0), HORIZONTAL, u'ALL')
+        >>> a.layout_key() == b.layout_key()
+        False
+        >>> b = Crossword(5, 5)
+        >>> b.embed((0, 0), VERTICAL, u'ALL')
+        >>> b.embed((0, 0), HORIZONTAL, u'ANT')
+        >>> a.layout_key() == b.layout_key()
+        True
+        '''
+        return (self.layout_hash *
+                hash_power(HASH_ROW_INV, HASH_ROW, self.grid.rowmin) *
+                hash_power(HASH_COL_INV, HASH_COL, self.grid.colmin)) & HASH_MASK
+
+    def lines(self):
+        u'''
+        Every row and column of the grid as a string, with the position of
+        its first cell and its direction.
+        '''
+        grid = self.grid
+        for row in range(grid.rowmin, grid.rowmax + 1):
+            yield (row, grid.colmin), HORIZONTAL, grid.get_row(row)
+        for col in range(grid.colmin, grid.colmax + 1):
+            yield (grid.rowmin, col), VERTICAL, grid.get_col(col)
 
     def is_all_words_valid(self):
-        for pos in self.allpos():
-            if not self.is_embedded(pos):
-                continue
-            p1 = Grid.pos_inc(pos, 1, VERTICAL)
-            if self.is_embedded(p1) and not self.is_connected(pos, p1):
-                return False
-            p2 = Grid.pos_inc(pos, 1, HORIZONTAL)
-            if self.is_embedded(p2) and not self.is_connected(pos, p2):
-                return False
+        u'''
+        >>> c = Crossword(3, 3)
+        >>> c.embed((0, 0), HORIZONTAL, u'AT')
+        >>> c.is_all_words_valid()
+        True
+        >>> c.embed((1, 1), HORIZONTAL, u'AN')
+        >>> c.is_all_words_valid()
+        False
+        '''
+        for pos, direction, line in self.lines():
+            for m in ADJACENT_LETTERS.finditer(line):
+                if not self.grid.is_linked(Grid.pos_inc(pos, m.start(), direction), direction):
+                    return False
         return True
 
     def finalize(self):
-        self.grid.fill_all_empty()
-        self.grid.shrink()
+        self.grid.fill_and_shrink()
         self.normalize()
 
     def normalize(self):
         pass
 
 
-def build_crossword(width, height, words, monitor=False):
+def build_crossword(width, height, words, monitor=False, grid_class=Grid, stats=None,
+                    canonical=False):
     u'''
     >>> result = build_crossword(3, 2, [u'AT', u'HAT'])
     >>> for r in result: r.dump()
@@ -408,20 +985,52 @@ def build_crossword(width, height, words, monitor=False):
     #GET#
     #####
 
+    stats collects counters and phase timings, see SearchStats.
+    >>> from searchstats import SearchStats
+    >>> stats = SearchStats()
+    >>> result = build_crossword(3, 3, [u'GET', u'JET'], stats=stats)
+    >>> sorted(stats.counters.items())
+    [('candidates', 22), ('invalid', 8), ('nodes', 7), ('results', 8)]
+
+    With canonical, crosswords which are a transposition or a shift of an
+    earlier one are left out.
+    >>> for r in build_crossword(3, 3, [u'GET', u'JET'], canonical=True): r.dump()
+    #####
+    #GET#
+    #####
+    #JET#
+    #####
+    #####
+    ##J##
+    #GET#
+    ##T##
+    #####
+    #####
+    #JET#
+    #####
+    #GET#
+    #####
+    #####
+    ###J#
+    ###E#
+    #GET#
+    #####
     '''
-    crosswords = [Crossword(width, height)]
+    if stats is None:
+        stats = NULL_STATS
+    crosswords = [Crossword(width, height, grid_class)]
+    # on a square grid, placing the first word across only drops the
+    # transpositions of the other crosswords
+    across_first = canonical and width == height
     for word in words:
         new_grids = []
         for grid in crosswords:
-            fits = find_all_fit(grid, word)
-            if not fits:
-                new_grids.append(grid)
-                continue
-            for (r, c, d) in fits:
-                new_grid = grid.copy()
-                new_grid.embed((r, c), d, word)
-                new_grids.append(new_grid)
+            expand_grid(grid, word, new_grids, stats, across_first)
+        if across_first and new_grids != crosswords:
+            across_first = False
         crosswords = new_grids
+        stats.frontier(len(crosswords))
+        stats.tick()
         if monitor:
             for c in crosswords:
                 c.dump(empty=monitor['EMPTY'], filled=monitor['FILLED'])
@@ -429,24 +1038,281 @@ def build_crossword(width, height, words, monitor=False):
 
     validated_crosswords = [g for g in crosswords if g.is_all_words_valid()]
     for g in validated_crosswords: g.finalize()
+    if canonical:
+        validated_crosswords = list(unique_layouts(validated_crosswords))
+    stats.count('invalid', len(crosswords) - len(validated_crosswords))
+    stats.count('results', len(validated_crosswords))
+    stats.emit()
     return validated_crosswords
 
 
+def expand_grid(grid, word, new_grids, stats, across_first=False):
+    u'''
+    Appends to new_grids a copy of grid with word embedded for every place
+    it fits, or grid itself when there is none.
+    '''
+    stats.count('nodes')
+    with stats.timer('fit'):
+        fits = find_all_fit(grid, word)
+    if across_first:
+        fits = [(r, c, d) for (r, c, d) in fits if d == HORIZONTAL]
+    if not fits:
+        new_grids.append(grid)
+        return
+    stats.count('candidates', len(fits))
+    for (r, c, d) in fits:
+        with stats.timer('copy'):
+            new_grid = grid.copy()
+            new_grid.embed((r, c), d, word)
+        new_grids.append(new_grid)
+
+
+def solve_crossword(width, height, words, grid_class=Grid, stats=None, canonical=False,
+                    unique=False, limit=None):
+    u'''
+    Depth-first version of build_crossword, yielding the same crosswords
+    in the same order one at a time.
+
+    Two adjacent letters which are not part of one word make a grid
+    invalid unless a later word is placed across both.  Such pairs are
+    kept with the placements of the remaining words which could still
+    repair them, and a grid is dropped as soon as one pair has none left.
+    A placement which does not fit now never fits later, so the dropped
+    grids are the ones build_crossword would discard at the end.
+
+    >>> def cells(crosswords): return [sorted(c.grid.cells.items()) for c in crosswords]
+    >>> words = [u'GET', u'JET']
+    >>> cells(solve_crossword(3, 3, words)) == cells(build_crossword(3, 3, words))
+    True
+    >>> words = [u'AT', u'HAT', u'TA']
+    >>> cells(solve_crossword(3, 2, words)) == cells(build_crossword(3, 2, words))
+    True
+    >>> for r in solve_crossword(3, 2, [u'AT', u'HAT']): r.dump()
+    ###
+    #A#
+    #T#
+    ###
+    #####
+    #HAT#
+    ##T##
+    #####
+    #####
+    ###A#
+    #HAT#
+    #####
+
+    canonical works as in build_crossword.
+    >>> words = [u'GET', u'JET', u'TEE']
+    >>> cells(solve_crossword(3, 3, words, canonical=True)) == cells(build_crossword(3, 3, words, canonical=True))
+    True
+
+    With unique, a crossword with the same letters as an earlier one after
+    shrinking is left out, and limit stops after that many crosswords.
+    >>> len(list(solve_crossword(4, 4, [u'GET', u'JET'])))
+    72
+    >>> len(list(solve_crossword(4, 4, [u'GET', u'JET'], unique=True)))
+    36
+    >>> for r in solve_crossword(4, 4, [u'GET', u'JET'], unique=True, limit=2): r.dump()
+    ######
+    #GET##
+    ####J#
+    ####E#
+    ####T#
+    ######
+    #####
+    #GET#
+    #####
+    #JET#
+    #####
+    '''
+    if limit is not None and limit <= 0:
+        return
+    if stats is None:
+        stats = NULL_STATS
+    words = list(words)
+    across_first = canonical and width == height
+    found = _finalized(_solve(Crossword(width, height, grid_class), words, 0, {}, stats, across_first))
+    if canonical or unique:
+        found = unique_layouts(found, transpositions=canonical)
+    for n, c in enumerate(found, 1):
+        stats.count('results')
+        yield c
+        if n == limit:
+            return
+
+
+def _finalized(crosswords):
+    for c in crosswords:
+        c.finalize()
+        yield c
+
+
+def unique_layouts(crosswords, transpositions=True):
+    u'''
+    Leaves out the finalized crosswords which are a shift, or with
+    transpositions also a transposition, of an earlier one.  In a valid
+    crossword every two adjacent letters belong to one word, so the
+    letters decide the whole layout.
+    '''
+    seen = set()
+    for c in crosswords:
+        rows = layout_rows(c)
+        if rows in seen:
+            continue
+        seen.add(rows)
+        if transpositions:
+            seen.add(tuple(u''.join(column) for column in zip(*rows)))
+        yield c
+
+
+def layout_rows(c):
+    grid = c.grid
+    return tuple(grid.get_row(row) for row in range(grid.rowmin, grid.rowmax + 1))
+
+
+def _solve(crossword, words, i, pending, stats, across_first=False):
+    if i == len(words):
+        if not pending:
+            yield crossword
+        return
+    word = words[i]
+    stats.count('nodes')
+    stats.tick()
+    fits = find_all_fit(crossword, word)
+    if across_first:
+        fits = [(r, c, d) for (r, c, d) in fits if d == HORIZONTAL]
+    if not fits:
+        pending = _check_repairs(crossword, words, i, pending)
+        if pending is not None:
+            for c in _solve(crossword, words, i + 1, pending, stats, across_first):
+                yield c
+        else:
+            stats.count('pruned')
+        return
+    stats.count('candidates', len(fits))
+    for (r, col, d) in fits:
+        child = crossword.copy()
+        child.embed((r, col), d, word)
+        child_pending = _check_repairs(child, words, i, pending)
+        if child_pending is not None:
+            child_pending = _add_violations(child, words, i, (r, col), d, child_pending)
+        if child_pending is None:
+            stats.count('pruned')
+            continue
+        for c in _solve(child, words, i + 1, child_pending, stats):
+            yield c
+
+
+def _check_repairs(crossword, words, i, pending):
+    u'''
+    Drops the pairs which got connected and the repairs which no longer
+    fit or belong to words already placed.  Returns None if some pair
+    cannot be repaired any more.  The pairs with the fewest repairs are
+    checked first.
+    '''
+    checked = {}
+    for (a, b, d), repairs in sorted(pending.items(), key=lambda kv: len(kv[1])):
+        if crossword.is_connected(a, b):
+            continue
+        repairs = [(j, p) for (j, p) in repairs
+                   if j > i and crossword.is_fit(p, d, words[j])]
+        if not repairs:
+            return None
+        checked[(a, b, d)] = repairs
+    return checked
+
+
+def _add_violations(crossword, words, i, pos, direction, pending):
+    u'''
+    Adds the unconnected pairs next to a newly placed word with their
+    repairs.  Returns None if one of them cannot be repaired.
+    '''
+    other = VERTICAL if direction == HORIZONTAL else HORIZONTAL
+    for p in crossword.grid.poslist(pos, direction, len(words[i])):
+        for q in (Grid.pos_inc(p, -1, other), Grid.pos_inc(p, 1, other)):
+            a, b = min(p, q), max(p, q)
+            if (a, b, other) in pending:
+                continue
+            if not crossword.is_embedded(q) or crossword.is_connected(a, b):
+                continue
+            pair = crossword.get(a) + crossword.get(b)
+            repairs = [(j, Grid.pos_inc(a, -k, other))
+                       for j in range(i + 1, len(words))
+                       for k in find_all(words[j], pair)
+                       if crossword.is_fit(Grid.pos_inc(a, -k, other), other, words[j])]
+            if not repairs:
+                return None
+            pending[(a, b, other)] = repairs
+    return pending
+
+
+def find_all(word, part):
+    u'''
+    >>> find_all(u'ANANAS', u'ANA')
+    [0, 2]
+    '''
+    found = []
+    k = word.find(part)
+    while k >= 0:
+        found.append(k)
+        k = word.find(part, k + 1)
+    return found
+
+
+# a letter followed by another letter
+LETTER = re.compile(u'[^%s%s]'%(re.escape(EMPTY), re.escape(FILLED)))
+ADJACENT_LETTERS = re.compile(u'(?=[^%s%s]{2})'%(re.escape(EMPTY), re.escape(FILLED)))
+
+
+def fit_pattern(word):
+    u'''
+    Matches, without consuming, where word could be written over a line:
+    every cell is empty or has the same letter, and the cells just before
+    and after are not letters.
+    '''
+    blank = re.escape(EMPTY)
+    not_letter = blank + re.escape(FILLED)
+    return re.compile(u'(?<![^%s])(?=%s(?![^%s]))'%(
+        not_letter, u''.join(u'[%s%s]'%(blank, re.escape(l)) for l in word), not_letter))
+
+
 def find_all_fit(crossword, word):
     u'''
+    Every (row, col, direction) where crossword.is_fit holds, in the
+    order of allpos with HORIZONTAL first.  Each row and column is matched
+    at once, and only the matches are checked for links.
+
     >>> c = Crossword(3, 3)
     >>> find_all_fit(c, u'ART')
     [(0, 0, 2), (0, 0, 1), (0, 1, 1), (0, 2, 1), (1, 0, 2), (2, 0, 2)]
     >>> c.grid.set((1, 2), u'X')
     >>> find_all_fit(c, u'ART')
     [(0, 0, 2), (0, 0, 1), (0, 1, 1), (2, 0, 2)]
+    >>> c = Crossword(4, 4)
+    >>> c.embed((0, 0), HORIZONTAL, u'ART')
+    >>> fits = find_all_fit(c, u'RT')
+    >>> (0, 1, HORIZONTAL) in fits, (0, 1, VERTICAL) in fits, len(fits)
+    (False, True, 15)
     '''
+    grid = crossword.grid
+    pattern = fit_pattern(word)
+    length = len(word)
     results = []
-    for (r, c) in crossword.allpos():
-        if crossword.is_fit((r, c), HORIZONTAL, word):
-            results.append((r, c, HORIZONTAL))
-        if crossword.is_fit((r, c), VERTICAL, word):
-            results.append((r, c, VERTICAL))
+    for pos, direction, line in crossword.lines():
+        size = len(line)
+        # the cells beyond the grid are empty
+        for m in pattern.finditer(line + EMPTY * length):
+            start = m.start()
+            if start >= size:
+                break
+            p = Grid.pos_inc(pos, start, direction)
+            span = line[start:start + length]
+            if any(span[k] != EMPTY and span[k + 1] != EMPTY and
+                   grid.is_linked(Grid.pos_inc(p, k, direction), direction)
+                   for k in range(length - 1)):
+                continue
+            results.append((p[0], p[1], direction))
+    results.sort(key=lambda fit: (fit[0], fit[1], fit[2] == VERTICAL))
     return results
 
 
@@ -1,28 +1,140 @@
 # coding: utf-8
 
+import heapq
+import itertools
+import multiprocessing
+import os
+import pickle
+import random
 import re
+import shutil
+import signal
+import tempfile
+import time
+from collections import OrderedDict
 
 from crossword import *
+from searchstats import NULL_STATS
+from wordindex import CrossingGraph, PatternCache, WordIndex
+
+try:
+    from os import replace as replace_file
+except ImportError:
+    # Python 2.7; rename replaces the target as well except on Windows
+    from os import rename as replace_file
 
 
 class Crossword2(Crossword):
 
-    def __init__(self):
-        self.grid = OpenGrid()
-        self.connected = {}
+    def __init__(self, grid_class=OpenGrid):
+        self.grid = grid_class()
+        self.grid_class = grid_class
+        self.layout_hash = 0
+        self.other_links = None
         self.used_words = []
+        self.placements = []
+        self.undo_log = []
+        self.line_sequences = {}
+        self.dirty_lines = set()
 
     def copy(self):
-        copied = Crossword2()
+        u'''
+        A copy starts with an empty undo log, so only the embeds made on it
+        after copying can be undone.
+        '''
+        copied = Crossword2(self.grid_class)
         copied.grid = self.grid.copy()
-        copied.connected = self.connected.copy()
+        copied.layout_hash = self.layout_hash
+        copied.other_links = None if self.other_links is None else self.other_links.copy()
         copied.used_words = self.used_words[:]
+        copied.placements = self.placements[:]
+        copied.line_sequences = self.line_sequences.copy()
+        copied.dirty_lines = self.dirty_lines.copy()
         return copied
 
     def embed(self, pos, direction, word):
         assert word not in self.used_words
+        poslist = self.grid.poslist(OpenGrid.pos_inc(pos, -1, direction), direction, len(word) + 2)
+        cells = [p for p in poslist if self.grid.is_empty(p)]
+        links = [p for p in poslist[1:-2] if not self.grid.is_linked(p, direction)]
+        area = self.grid.save_area()
+        layout_hash = self.layout_hash
         super(Crossword2, self).embed(pos, direction, word)
         self.used_words.append(word)
+        self.placements.append((pos, direction, word))
+        self.undo_log.append((cells, links, area, layout_hash))
+        self.dirty_lines.update(self.affected_lines(pos, direction, len(word)))
+
+    def undo(self):
+        u'''
+        Reverts the last embed.
+
+        >>> c = Crossword2()
+        >>> c.embed((0, 0), HORIZONTAL, 'ANT')
+        >>> c.embed((0, 1), VERTICAL, 'NOT')
+        >>> c.undo()
+        >>> c.dump()
+        #ANT#
+        >>> c.all_disconnected_sequences()
+        [((0, 2), 2, 'T'), ((0, 0), 1, 'A'), ((0, 1), 1, 'N'), ((0, 2), 1, 'T')]
+        >>> c.placements
+        [((0, 0), 2, 'ANT')]
+        '''
+        pos, direction, word = self.placements.pop()
+        cells, links, area, self.layout_hash = self.undo_log.pop()
+        for p in links:
+            self.grid.unlink(p, direction)
+        for p in cells:
+            self.grid.erase(p)
+        self.grid.restore_area(area)
+        self.used_words.pop()
+        self.dirty_lines.update(self.affected_lines(pos, direction, len(word)))
+
+    def replay(self, placements):
+        u'''
+        Brings the crossword to the given placements, undoing embeds back
+        to the common prefix and embedding the rest.
+        '''
+        common = 0
+        for done, wanted in zip(self.placements, placements):
+            if done != wanted: break
+            common += 1
+        while len(self.placements) > common:
+            self.undo()
+        for pos, direction, word in placements[common:]:
+            self.embed(pos, direction, word)
+
+    @staticmethod
+    def line_key(pos, direction):
+        row, col = pos
+        return (0, row) if direction == HORIZONTAL else (1, col)
+
+    def affected_lines(self, pos, direction, length):
+        u'''
+        Lines whose sequences change by embedding a word: the line of the
+        word itself and the crossing lines of its letters and both ends.
+
+        >>> Crossword2().affected_lines((2, 3), HORIZONTAL, 2)
+        [(0, 2), (1, 2), (1, 3), (1, 4), (1, 5)]
+        '''
+        other = VERTICAL if direction == HORIZONTAL else HORIZONTAL
+        return ([self.line_key(pos, direction)] +
+                [self.line_key(p, other)
+                 for p in self.grid.poslist(OpenGrid.pos_inc(pos, -1, direction), direction, length + 2)])
+
+    def refresh_line(self, key):
+        kind, idx = key
+        if kind == 0:
+            pos, direction, length = (idx, self.grid.colmin), HORIZONTAL, self.grid.width
+        else:
+            pos, direction, length = (self.grid.rowmin, idx), VERTICAL, self.grid.height
+        line = self.grid.get_word(pos, direction, length)
+        poslist = self.grid.poslist(pos, direction, length)
+        sequences = [(p, d, w) for (p, d, w) in self.extract_sequences(line, poslist, direction) if not w.endswith('.')]
+        if sequences:
+            self.line_sequences[key] = sequences
+        else:
+            self.line_sequences.pop(key, None)
 
     def all_disconnected_sequences(self):
         '''
@@ -42,14 +154,15 @@ class Crossword2(Crossword):
         [((0, 2), 2, 'T'), ((1, 0), 2, 'T'), ((2, 0), 2, 'O'), ((0, 1), 1, 'N'), ((3, 1), 1, 'E'), ((0, 2), 1, 'TI'), ((0, 2), 1, 'TI.E'), ((3, 2), 1, 'E'), ((1, 3), 1, 'T'), ((1, 3), 1, 'T.T'), ((3, 3), 1, 'T')]
 
         '''
+        for key in self.dirty_lines:
+            self.refresh_line(key)
+        self.dirty_lines.clear()
         sequences = []
-        for pos, direction, length in [((r, self.grid.colmin), HORIZONTAL, self.grid.width) for r in range(self.grid.rowmin, self.grid.rowmax + 1)] + [((self.grid.rowmin, c), VERTICAL, self.grid.height) for c in range(self.grid.colmin, self.grid.colmax + 1)]:
-            line = self.grid.get_word(pos, direction, length)
-            poslist = self.grid.poslist(pos, direction, length)
-            sequences += self.extract_sequences(line, poslist, direction)
-        return [(p, d, w) for (p, d, w) in sequences if not w.endswith('.')]
+        for key in sorted(self.line_sequences):
+            sequences += self.line_sequences[key]
+        return sequences
 
-    def extract_sequences(self, line, poslist, direction, idx=0, current_seq=None):
+    def extract_sequences(self, line, poslist, direction):
         '''
         >>> c = Crossword2()
         >>> c.extract_sequences('ABC', [(0, 0), (0, 1), (0, 2)], HORIZONTAL)
@@ -65,28 +178,729 @@ class Crossword2(Crossword):
         >>> c.extract_sequences('A_B__C', [(0, 0), (0, 1), (0, 2), (0, 3), (0, 4), (0,5)], HORIZONTAL)
         [((0, 0), 2, 'A'), ((0, 0), 2, 'A.B'), ((0, 2), 2, 'B'), ((0, 0), 2, 'A.B.'), ((0, 2), 2, 'B.'), ((0, 0), 2, 'A.B..C'), ((0, 2), 2, 'B..C'), ((0, 5), 2, 'C')]
         '''
-        if not current_seq: current_seq = []
-        if idx >= len(line): return current_seq
-        c = line[idx]
-        pos = poslist[idx]
-
-        if c == FILLED:
-            return current_seq + self.extract_sequences(line, poslist, direction, idx + 1, [])
-        if c == EMPTY:
-            new_current_seq = [(p, d, s + '.') for (p, d, s) in current_seq]
-            return current_seq + self.extract_sequences(line, poslist, direction, idx + 1, new_current_seq)
-
-        if current_seq:
-            new_current_seq = [(p, d, s + c) for (p, d, s) in current_seq if not self.is_connected(poslist[idx - 1], pos)]
-            if any([s.endswith('.') for (p, d, s) in current_seq]):
-                new_current_seq.append((pos, direction, c))
-            return self.extract_sequences(line, poslist, direction, idx + 1, new_current_seq)
+        # Open sequences all end at the current cell, so each of them is
+        # kept as its start index and sliced out of the line when it ends.
+        dotted = line.replace(EMPTY, '.')
+        sequences = []
+        starts = []
+        for idx, c in enumerate(line):
+            if c == FILLED or c == EMPTY:
+                sequences += [(poslist[s], direction, dotted[s:idx]) for s in starts]
+                if c == FILLED: starts = []
+            elif not starts:
+                starts = [idx]
+            elif line[idx - 1] == EMPTY:
+                starts.append(idx)
+            elif self.grid.is_linked(poslist[idx - 1], direction):
+                starts = []
+        sequences += [(poslist[s], direction, dotted[s:]) for s in starts]
+        return sequences
+
+
+class TranspositionTable(object):
+    '''
+    Set of layout keys already reached by the search.  With maxsize, only
+    the most recently seen keys are kept.
+
+    >>> t = TranspositionTable(maxsize=2)
+    >>> [t.seen(k) for k in [1, 2, 1, 3, 1, 2]]
+    [False, False, True, False, True, False]
+    >>> t.pruned, len(t)
+    (2, 2)
+    '''
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.keys = OrderedDict()
+        self.pruned = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def seen(self, key):
+        if key in self.keys:
+            self.pruned += 1
+            if self.maxsize:
+                del self.keys[key]
+                self.keys[key] = True
+            return True
+        self.keys[key] = True
+        if self.maxsize and len(self.keys) > self.maxsize:
+            self.keys.popitem(last=False)
+        return False
+
+    def forget(self, keys):
+        u'''
+        Removes keys which seen added, for children which were not pushed
+        after all.
+        '''
+        for key in keys:
+            self.keys.pop(key, None)
+
+    def report(self):
+        return '%d layouts stored, %d duplicates pruned'%(len(self), self.pruned)
+
+
+class Frontier(object):
+    '''
+    Best-first priority queue of search nodes.
+
+    Each node is scored once when it is pushed.  Nodes with the same
+    score come out in insertion order, so the search is deterministic.
+
+    >>> f = Frontier(evaluate=len)
+    >>> for s in ['ccc', 'a', 'bb', 'x', 'yy']: f.push(s)
+    >>> [f.pop() for _ in range(len(f))]
+    ['a', 'x', 'bb', 'yy', 'ccc']
+    >>> f.pushed, f.popped
+    (5, 5)
+    '''
+
+    def __init__(self, evaluate=None):
+        self.evaluate = evaluate or evaluate_crossword
+        self.heap = []
+        self.counter = itertools.count()
+        self.pushed = 0
+        self.popped = 0
+        self.last = None
+        self.started = time.time()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, node, score=None):
+        if score is None:
+            score = self.evaluate(node)
+        heapq.heappush(self.heap, (score, next(self.counter), node))
+        self.pushed += 1
+
+    def pop(self):
+        score, count, node = heapq.heappop(self.heap)
+        self.popped += 1
+        self.last = (score, count)
+        return node
+
+    def requeue(self, node, entry):
+        u'''
+        Puts back a popped node, with entry the value of last right after
+        its pop, so that it comes out again in the same place.
+
+        >>> f = Frontier(evaluate=len)
+        >>> for s in ['a', 'b', 'c']: f.push(s)
+        >>> node = f.pop()
+        >>> f.requeue(node, f.last)
+        >>> [f.pop() for _ in range(len(f))]
+        ['a', 'b', 'c']
+        '''
+        score, count = entry
+        heapq.heappush(self.heap, (score, count, node))
+        self.popped -= 1
+
+    def throughput(self):
+        elapsed = time.time() - self.started
+        if elapsed <= 0: return 0.0
+        return self.popped / elapsed
+
+    def report(self):
+        return '%d candidates... (%d expanded, %.1f nodes/sec)'%(
+            len(self), self.popped, self.throughput())
+
+    def next_count(self):
+        count = next(self.counter)
+        self.counter = itertools.count(count)
+        return count
+
+    def entries(self, encode):
+        u'''
+        The pending nodes as (score, count, encode(node)), for a checkpoint.
+        '''
+        return [(score, count, encode(node)) for score, count, node in self.heap]
+
+    def segment_files(self):
+        u'''
+        The (score, count, path, size) of the segment files holding the
+        nodes entries leaves out.
+        '''
+        return []
+
+    def read_segment(self, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def restore(self, entries, decode, count, segments=()):
+        u'''
+        Puts back the entries and the segment files of a checkpoint; count
+        is the next insertion count, so nodes pushed later still come
+        after them.
+
+        >>> f = Frontier(evaluate=len)
+        >>> for s in ['ccc', 'a', 'bb']: f.push(s)
+        >>> g = Frontier(evaluate=len)
+        >>> g.restore(f.entries(str.upper), str.lower, f.next_count())
+        >>> g.push('x')
+        >>> [g.pop() for _ in range(len(g))]
+        ['a', 'x', 'bb', 'ccc']
+        '''
+        entries = list(entries)
+        for _, _, path, _ in segments:
+            entries += self.read_segment(path)
+        self.heap = [(score, c, decode(data)) for score, c, data in entries]
+        heapq.heapify(self.heap)
+        self.counter = itertools.count(count)
+
+    def close(self):
+        pass
+
+
+class SearchBudget(object):
+    u'''
+    Stops a search at a deadline (a clock() value, by default time.time())
+    or after a number of expanded nodes.  The nodes are counted between
+    expansions.  The deadline is also checked within an expansion, every
+    CHECK_PROPOSALS proposed words and for every candidate, which then
+    stops and puts its node back in the frontier.
+
+    >>> b = SearchBudget(nodes=3)
+    >>> b.allow(2), b.spend(2), b.allow(2), b.spend(1), b.allow()
+    (2, None, 1, None, 0)
+    >>> b.expanded, b.reason
+    (3, 'node_budget')
+
+    The first expansion on words.all proposes tens of thousands of words
+    for each sequence, and still stops at the deadline within it.
+    >>> import os
+    >>> from wordindex import load_words
+    >>> index = WordIndex(load_words(os.path.join(os.path.dirname(__file__), 'words.all')))
+    >>> ticks = itertools.count()
+    >>> b = SearchBudget(deadline=10, clock=lambda: next(ticks))
+    >>> list(build_crossword2(index, budget=b, copy_free=True)), b.reason, next(ticks)
+    ([], 'deadline', 11)
+    '''
+
+    CHECK_PROPOSALS = 256
+
+    def __init__(self, deadline=None, nodes=None, clock=time.time):
+        self.deadline = deadline
+        self.nodes = nodes
+        self.clock = clock
+        self.expanded = 0
+        self.reason = None
+
+    def allow(self, n=1):
+        u'''
+        Returns how many of the next n nodes may be expanded.
+        '''
+        if self.expired():
+            return 0
+        if self.nodes is not None and self.expanded + n > self.nodes:
+            n = max(0, self.nodes - self.expanded)
+            if n == 0:
+                self.reason = 'node_budget'
+        return n
+
+    def spend(self, n=1):
+        self.expanded += n
+
+    def expired(self):
+        u'''
+        Whether the search must stop now, whatever the nodes.  It is cheap
+        enough to ask for every candidate of an expansion.
+        '''
+        if self.deadline is not None and self.clock() >= self.deadline:
+            self.reason = 'deadline'
+            return True
+        return False
+
+
+class BudgetExpired(Exception):
+    u'''
+    Raised within an expansion when its SearchBudget expires.
+    '''
+
+
+class CancellableBudget(SearchBudget):
+    u'''
+    SearchBudget which also stops once the multiprocessing.Event cancel
+    is set by another process.  Within an expansion, the event is only
+    looked at every CHECK_EVERY calls, as it takes a lock.
+    '''
+
+    CHECK_EVERY = 64
+
+    def __init__(self, cancel, deadline=None, nodes=None):
+        super(CancellableBudget, self).__init__(deadline, nodes)
+        self.cancel = cancel
+        self.calls = 0
+
+    def allow(self, n=1):
+        if self.cancel.is_set():
+            self.reason = 'cancelled'
+            return 0
+        return super(CancellableBudget, self).allow(n)
+
+    def expired(self):
+        self.calls += 1
+        if self.calls % self.CHECK_EVERY == 0 and self.cancel.is_set():
+            self.reason = 'cancelled'
+            return True
+        return super(CancellableBudget, self).expired()
+
+
+class Checkpoint(object):
+    u'''
+    Writes the state of a build_crossword2 search to path every interval
+    seconds, and once more when the search ends or stops at its budget.
+    After one of signals, the state is written at the next node and the
+    search stops.  build_crossword2 with resume=path continues from the
+    file and yields the crosswords the interrupted search had not yielded
+    yet.
+
+    A file is written under a temporary name and then renamed, so path
+    always holds a complete checkpoint.  The segment files of a
+    SpillingFrontier are linked, or copied where they cannot be, next to
+    path instead of being read into the file.
+    '''
+
+    def __init__(self, path, interval=600.0, signals=(signal.SIGTERM,), clock=time.time):
+        self.path = path
+        self.interval = interval
+        self.signals = signals
+        self.clock = clock
+        self.snapshot = None
+        self.previous = {}
+        self.requested = False
+        self.saved = 0
+        self.last_saved = None
+        self.linked = set()
+
+    def attach(self, snapshot):
+        u'''
+        Starts saving what snapshot() returns, and catches the signals
+        when called in the main thread.
+        '''
+        self.snapshot = snapshot
+        self.last_saved = self.clock()
+        for signum in self.signals:
+            try:
+                self.previous[signum] = signal.signal(signum, self.request)
+            except ValueError:
+                # not the main thread
+                pass
+
+    def detach(self):
+        for signum, handler in self.previous.items():
+            signal.signal(signum, handler)
+        self.previous = {}
+        self.snapshot = None
+
+    def request(self, signum=None, frame=None):
+        self.requested = True
+
+    def tick(self):
+        u'''
+        Called between nodes.  Saves if it is time to, and returns False
+        once the search should stop.
+        '''
+        if self.requested or (self.interval is not None and
+                               self.clock() - self.last_saved >= self.interval):
+            self.save()
+        return not self.requested
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + '.'
+        state = self.snapshot()
+        segments = []
+        for score, count, source, size in state['segments']:
+            name = prefix + os.path.basename(source)
+            if name not in self.linked:
+                target = os.path.join(directory, name)
+                if os.path.exists(target):
+                    # left by an earlier search
+                    os.remove(target)
+                link_file(source, target)
+            segments.append((score, count, name, size))
+        state['segments'] = segments
+        fd, path = tempfile.mkstemp(prefix='.checkpoint-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            replace_file(path, self.path)
+        except BaseException:
+            os.remove(path)
+            raise
+        self.linked = set(name for _, _, name, _ in segments)
+        for name in os.listdir(directory):
+            if (name.startswith(prefix + 'frontier-') and name.endswith('.seg') and
+                    name not in self.linked):
+                os.remove(os.path.join(directory, name))
+        self.saved += 1
+        self.last_saved = self.clock()
+
+
+def link_file(source, target):
+    u'''
+    Hard links source as target, or copies it on systems or across file
+    systems without hard links.
+    '''
+    try:
+        os.link(source, target)
+    except (AttributeError, OSError):
+        shutil.copyfile(source, target)
+
+
+CHECKPOINT_VERSION = 2
+
+
+def load_checkpoint(path):
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError('%s is not a checkpoint of this version'%(path))
+    directory = os.path.dirname(os.path.abspath(path))
+    state['segments'] = [(score, count, os.path.join(directory, name), size)
+                         for score, count, name, size in state['segments']]
+    return state
+
+
+def search_state(word_list, start, index, frontier, encode, transpositions, incumbent):
+    u'''
+    Everything a search needs to go on: the frontier entries with their
+    placements packed as in pack_placements, the segment files of the
+    rest of the frontier, the layouts seen and the incumbent.
+    '''
+    state = {
+        'version': CHECKPOINT_VERSION,
+        'words': word_list,
+        'start': start,
+        'frontier': frontier.entries(encode),
+        'segments': frontier.segment_files(),
+        'counter': frontier.next_count(),
+        'pushed': frontier.pushed,
+        'popped': frontier.popped,
+        'transpositions': None,
+        'incumbent': None,
+    }
+    if transpositions is not None:
+        state['transpositions'] = (list(transpositions.keys), transpositions.pruned)
+    if incumbent is not None:
+        best = incumbent.crossword
+        state['incumbent'] = (incumbent.score, incumbent.pruned,
+                              None if best is None else pack_placements(best.placements, index))
+    return state
+
+
+def restore_search(state, index, frontier, decode, transpositions, incumbent, grid_class):
+    frontier.restore(state['frontier'], decode, state['counter'], state['segments'])
+    frontier.pushed = state['pushed']
+    frontier.popped = state['popped']
+    if transpositions is not None and state['transpositions'] is not None:
+        keys, transpositions.pruned = state['transpositions']
+        transpositions.keys = OrderedDict((key, True) for key in keys)
+    if incumbent is not None and state['incumbent'] is not None:
+        incumbent.score, incumbent.pruned, best = state['incumbent']
+        if best is not None:
+            incumbent.crossword = Crossword2(grid_class)
+            incumbent.crossword.replay(unpack_placements(best, index))
+
+
+class SearchNode(object):
+    u'''
+    Frontier entry of the copy-free search: the last placement and the
+    node it was added to.  Nodes share their ancestors, so each costs the
+    same few slots at any depth, and the crossword is only rebuilt from
+    the placements when the node is expanded.
+
+    >>> root = SearchNode(None, (0, 0), HORIZONTAL, 'ANT')
+    >>> node = SearchNode(root, (0, 1), VERTICAL, 'NOT')
+    >>> node.depth, node.placements()
+    (2, (((0, 0), 2, 'ANT'), ((0, 1), 1, 'NOT')))
+    >>> SearchNode.from_placements(node.placements()).placements() == node.placements()
+    True
+    '''
+
+    __slots__ = ('parent', 'row', 'col', 'direction', 'word', 'depth')
+
+    def __init__(self, parent, pos, direction, word):
+        self.parent = parent
+        self.row, self.col = pos
+        self.direction = direction
+        self.word = word
+        self.depth = 1 if parent is None else parent.depth + 1
+
+    @classmethod
+    def from_placements(cls, placements):
+        node = None
+        for p, d, w in placements:
+            node = cls(node, p, d, w)
+        return node
+
+    def placements(self):
+        placements = []
+        node = self
+        while node is not None:
+            placements.append(((node.row, node.col), node.direction, node.word))
+            node = node.parent
+        placements.reverse()
+        return tuple(placements)
+
+
+def node_depth(node):
+    if isinstance(node, SearchNode):
+        return node.depth
+    return len(node.used_words)
+
+
+class BeamFrontier(Frontier):
+    '''
+    Frontier keeping only the best width pending nodes of each depth
+    (number of embedded words).  Worse nodes are dropped.
+
+    >>> f = BeamFrontier(2, evaluate=len, depth=lambda s: s[0])
+    >>> for s in ['aaa', 'a', 'aa', 'b', 'bbbb', 'bb', 'bbb']: f.push(s)
+    >>> [f.pop() for _ in range(len(f))]
+    ['a', 'b', 'aa', 'bb']
+    >>> f.dropped
+    3
+    '''
+
+    def __init__(self, width, evaluate=None, depth=None):
+        super(BeamFrontier, self).__init__(evaluate)
+        self.width = width
+        self.depth = depth or node_depth
+        self.levels = {}
+        self.alive = {}
+        self.evicted = set()
+        self.released = set()
+        self.size = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.size
+
+    def trim(self, level):
+        while level and -level[0][1] in self.released:
+            self.released.remove(-heapq.heappop(level)[1])
+
+    def push(self, node, score=None):
+        if score is None:
+            score = self.evaluate(node)
+        count = next(self.counter)
+        depth = self.depth(node)
+        level = self.levels.setdefault(depth, [])
+        if self.alive.get(depth, 0) >= self.width:
+            self.trim(level)
+            worst = (-level[0][0], -level[0][1])
+            self.dropped += 1
+            if (score, count) > worst:
+                return
+            heapq.heappop(level)
+            self.evicted.add(worst[1])
+            self.alive[depth] -= 1
+            self.size -= 1
+        heapq.heappush(level, (-score, -count))
+        heapq.heappush(self.heap, (score, count, node, depth))
+        self.alive[depth] = self.alive.get(depth, 0) + 1
+        self.size += 1
+        self.pushed += 1
+        if len(self.evicted) > self.size:
+            self.compact()
+
+    def compact(self):
+        u'''
+        Drops the evicted nodes from the heap.  It is done once they
+        outnumber the pending ones, so the heap stays within twice the
+        size of the beam.
+
+        >>> f = BeamFrontier(2, evaluate=lambda s: -len(s), depth=lambda s: 0)
+        >>> for n in range(100): f.push('a' * n)
+        >>> len(f), len(f.heap) <= 2 * len(f) + 1
+        (2, True)
+        >>> [len(f.pop()) for _ in range(len(f))]
+        [99, 98]
+        '''
+        self.heap = [entry for entry in self.heap if entry[1] not in self.evicted]
+        heapq.heapify(self.heap)
+        self.evicted.clear()
+
+    def requeue(self, node, entry):
+        score, count = entry
+        depth = self.depth(node)
+        if count in self.released:
+            # its entry is still in the level
+            self.released.remove(count)
         else:
-            new_current_seq = [(pos, direction, c)]
-            return self.extract_sequences(line, poslist, direction, idx + 1, new_current_seq)
+            heapq.heappush(self.levels.setdefault(depth, []), (-score, -count))
+        heapq.heappush(self.heap, (score, count, node, depth))
+        self.alive[depth] = self.alive.get(depth, 0) + 1
+        self.size += 1
+        self.popped -= 1
+
+    def entries(self, encode):
+        return [(score, count, encode(node)) for score, count, node, _ in self.heap
+                if count not in self.evicted]
+
+    def restore(self, entries, decode, count, segments=()):
+        entries = list(entries)
+        for _, _, path, _ in segments:
+            entries += self.read_segment(path)
+        for score, c, data in entries:
+            node = decode(data)
+            depth = self.depth(node)
+            heapq.heappush(self.levels.setdefault(depth, []), (-score, -c))
+            heapq.heappush(self.heap, (score, c, node, depth))
+            self.alive[depth] = self.alive.get(depth, 0) + 1
+            self.size += 1
+        self.counter = itertools.count(count)
+
+    def pop(self):
+        while True:
+            score, count, node, depth = heapq.heappop(self.heap)
+            if count not in self.evicted: break
+            self.evicted.remove(count)
+        self.alive[depth] -= 1
+        self.size -= 1
+        self.popped += 1
+        self.last = (score, count)
+        self.released.add(count)
+        level = self.levels[depth]
+        if len(level) > 2 * self.width:
+            # forget popped nodes buried in the level
+            kept = []
+            for entry in level:
+                if -entry[1] in self.released:
+                    self.released.remove(-entry[1])
+                else:
+                    kept.append(entry)
+            level[:] = kept
+            heapq.heapify(level)
+        return node
+
+
+class SpillingFrontier(Frontier):
+    '''
+    Frontier keeping at most about max_nodes nodes in memory.  When it
+    grows beyond that, the worse half is written to a segment file in
+    directory.  A segment is read back as soon as it holds the best node,
+    so nodes come out in exactly the same order as from Frontier.
+
+    >>> f = SpillingFrontier(4, evaluate=len)
+    >>> for s in ['ccc', 'a', 'bb', 'x', 'yy', 'dddd', 'e', 'ff']: f.push(s)
+    >>> len(f), len(f.heap), len(f.segments)
+    (8, 2, 2)
+    >>> [f.pop() for _ in range(len(f))]
+    ['a', 'x', 'e', 'bb', 'yy', 'ff', 'ccc', 'dddd']
+    >>> f.spilled, len(f.segments)
+    (6, 0)
+    '''
+
+    def __init__(self, max_nodes, directory=None, encode=None, decode=None, evaluate=None):
+        super(SpillingFrontier, self).__init__(evaluate)
+        self.max_nodes = max_nodes
+        self.directory = directory
+        self.encode = encode or (lambda node: node)
+        self.decode = decode or (lambda data: data)
+        self.segments = []
+        self.spilled_size = 0
+        self.spilled = 0
+        self.written = 0
+
+    def __len__(self):
+        return len(self.heap) + self.spilled_size
+
+    def push(self, node, score=None):
+        super(SpillingFrontier, self).push(node, score)
+        if len(self.heap) > self.max_nodes:
+            self.spill()
+
+    def spill(self):
+        entries = sorted(self.heap)
+        keep = max(1, self.max_nodes // 2)
+        self.heap = entries[:keep]
+        self.write_segment([(score, count, self.encode(node)) for score, count, node in entries[keep:]])
+
+    def segment_file(self):
+        # numbered, so that a name is never used twice by one frontier
+        self.written += 1
+        return tempfile.mkstemp(prefix='frontier-%d-'%(self.written), suffix='.seg',
+                                dir=self.directory)
+
+    def write_segment(self, rest):
+        fd, path = self.segment_file()
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(rest, f, pickle.HIGHEST_PROTOCOL)
+        heapq.heappush(self.segments, (rest[0][0], rest[0][1], path, len(rest)))
+        self.spilled_size += len(rest)
+        self.spilled += len(rest)
+
+    def load(self, segment):
+        _, _, path, size = segment
+        entries = self.read_segment(path)
+        os.remove(path)
+        for score, count, data in entries:
+            heapq.heappush(self.heap, (score, count, self.decode(data)))
+        self.spilled_size -= size
+
+    def pop(self):
+        while self.segments and (not self.heap or self.segments[0][:2] < self.heap[0][:2]):
+            self.load(heapq.heappop(self.segments))
+        return super(SpillingFrontier, self).pop()
+
+    def segment_files(self):
+        # the segments hold data encoded by self.encode, which must be encode
+        return sorted(self.segments)
+
+    def restore(self, entries, decode, count, segments=()):
+        u'''
+        Takes the segment files of a checkpoint over through links, so
+        that they are not read before the search gets to them.
+        '''
+        super(SpillingFrontier, self).restore(entries, decode, count)
+        for score, c, source, size in segments:
+            fd, path = self.segment_file()
+            os.close(fd)
+            os.remove(path)
+            link_file(source, path)
+            heapq.heappush(self.segments, (score, c, path, size))
+            self.spilled_size += size
+
+    def report(self):
+        return '%s (%d on disk in %d segments)'%(
+            super(SpillingFrontier, self).report(), self.spilled_size, len(self.segments))
+
+    def close(self):
+        for _, _, path, _ in self.segments:
+            os.remove(path)
+        self.segments = []
+        self.spilled_size = 0
+
+
+def pack_placements(placements, index):
+    u'''
+    Compact form of placements as a flat tuple of integers.
+
+    >>> index = WordIndex(['ANT', 'ART'])
+    >>> data = pack_placements([((0, 0), HORIZONTAL, 'ANT'), ((-1, 1), VERTICAL, 'ART')], index)
+    >>> data
+    (0, 0, 2, 0, -1, 1, 1, 1)
+    >>> unpack_placements(data, index)
+    (((0, 0), 2, 'ANT'), ((-1, 1), 1, 'ART'))
+    '''
+    return tuple(n for (r, c), d, w in placements for n in (r, c, d, index.word_id(w)))
 
 
-def build_crossword2(words, monitor=False):
+def unpack_placements(data, words):
+    return tuple(((data[i], data[i + 1]), data[i + 2], words[data[i + 3]])
+                 for i in range(0, len(data), 4))
+
+
+def build_crossword2(words, monitor=False, frontier=None, grid_class=OpenGrid, copy_free=False,
+                     transpositions=None, processes=None, batch_size=None, deterministic=True,
+                     beam_width=None, max_frontier=None, spill_dir=None, start=None, stats=None,
+                     budget=None, incumbent=None, cache_size=None, prune_words=False,
+                     canonical=False, checkpoint=None, resume=None):
     '''
     >>> ans = list(build_crossword2(['ANT', 'ART', 'RAT']))
     >>> ans[0].dump()
@@ -183,47 +997,399 @@ def build_crossword2(words, monitor=False):
     _#___
     >>> len(ans)
     15
+
+    The frontier keeps track of the search progress.
+    >>> f = Frontier()
+    >>> ans = list(build_crossword2(['ANT', 'ART', 'RAT'], frontier=f))
+    >>> f.pushed, f.popped, len(f)
+    (17, 17, 0)
+
+    With copy_free, a single crossword is modified in place and the
+    frontier only holds a SearchNode for each node.
+    >>> ans2 = list(build_crossword2(['ANT', 'ART', 'RAT'], copy_free=True))
+    >>> [c.placements for c in ans] == [c.placements for c in ans2]
+    True
+
+    A transposition table drops layouts reached through another order of
+    the same placements.
+    >>> t = TranspositionTable()
+    >>> ans3 = list(build_crossword2(['ANT', 'ART', 'RAT'], transpositions=t))
+    >>> len(ans3), t.pruned
+    (13, 2)
+
+    With processes, nodes are expanded on a process pool in batches.
+    A batch of one node gives the same sequence as the serial search.
+    >>> ans4 = list(build_crossword2(['ANT', 'ART', 'RAT'], processes=2, batch_size=1))
+    >>> [c.placements for c in ans] == [c.placements for c in ans4]
+    True
+    >>> ans5 = list(build_crossword2(['ANT', 'ART', 'RAT'], processes=2, copy_free=True))
+    >>> sorted(c.placements for c in ans) == sorted(c.placements for c in ans5)
+    True
+
+    beam_width keeps only the best nodes of each depth, and max_frontier
+    spills the worse part of the frontier to files in spill_dir.
+    >>> len(list(build_crossword2(['ANT', 'ART', 'RAT'], beam_width=1)))
+    2
+    >>> ans6 = list(build_crossword2(['ANT', 'ART', 'RAT'], max_frontier=2))
+    >>> [c.placements for c in ans] == [c.placements for c in ans6]
+    True
+
+    stats collects counters and phase timings of the search.  With
+    processes, the phases run in the workers are not timed.
+    >>> from searchstats import SearchStats
+    >>> stats = SearchStats()
+    >>> ans7 = list(build_crossword2(['ANT', 'ART', 'RAT'], stats=stats))
+    >>> sorted(stats.counters.items())
+    [('candidates', 16), ('dead_ends', 2), ('invalid', 10), ('nodes', 17), ('results', 15)]
+    >>> sorted(stats.phases)
+    ['copy', 'fit', 'proposal', 'scoring', 'sequences']
+
+    budget stops the search cleanly, see SearchBudget.
+    >>> budget = SearchBudget(nodes=5)
+    >>> ans8 = list(build_crossword2(['ANT', 'ART', 'RAT'], budget=budget))
+    >>> [c.placements for c in ans8] == [c.placements for c in ans[:len(ans8)]]
+    True
+    >>> budget.expanded, budget.reason
+    (5, 'node_budget')
+
+    incumbent keeps the best result, and the nodes which cannot beat it
+    are dropped, see Incumbent.
+    >>> best = Incumbent()
+    >>> ans9 = list(build_crossword2(['ANT', 'ART', 'RAT'], incumbent=best))
+    >>> best.score, best.pruned, len(ans9)
+    (1.2222222222222223, 8, 7)
+
+    cache_size keeps the matches of that many patterns, see PatternCache.
+    >>> ans10 = list(build_crossword2(['ANT', 'ART', 'RAT'], cache_size=100))
+    >>> [c.placements for c in ans] == [c.placements for c in ans10]
+    True
+
+    prune_words drops the words which share no letters with the start
+    word, directly or through other words, before the search.
+    >>> ans11 = list(build_crossword2(['ANT', 'ART', 'OX', 'RAT'], prune_words=True))
+    >>> [c.placements for c in ans] == [c.placements for c in ans11]
+    True
+
+    canonical keeps one crossword of the layouts which are shifts of each
+    other, through a TranspositionTable unless one is given.  The first
+    word always goes across, so a transposed layout is never reached.
+    >>> len(list(build_crossword2(['ANT', 'ART', 'RAT'], canonical=True)))
+    13
+
+    checkpoint saves the search to a file, see Checkpoint, and resume
+    continues from one.  Give the same words and options to both; the
+    budget and stats count from the resume.
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'search.ckpt')
+    >>> words = ['ANT', 'ART', 'RAT']
+    >>> first = list(build_crossword2(words, budget=SearchBudget(nodes=5),
+    ...                               checkpoint=Checkpoint(path)))
+    >>> rest = list(build_crossword2(words, resume=path))
+    >>> [c.placements for c in first + rest] == [c.placements for c in ans]
+    True
+
+    A spilled frontier keeps its segment files next to the checkpoint.
+    >>> first = list(build_crossword2(words, max_frontier=2, budget=SearchBudget(nodes=5),
+    ...                               checkpoint=Checkpoint(path)))
+    >>> sorted(os.listdir(os.path.dirname(path)))[-1].startswith('search.ckpt.frontier-')
+    True
+    >>> rest = list(build_crossword2(words, max_frontier=2, resume=path))
+    >>> [c.placements for c in first + rest] == [c.placements for c in ans]
+    True
+    '''
+    if stats is None:
+        stats = NULL_STATS
+    word_list = list(words) if checkpoint is not None else None
+    state = None
+    if resume is not None:
+        state = load_checkpoint(resume)
+        if state['words'] != list(words):
+            raise ValueError('%s was written for another word list'%(resume))
+        start = state['start']
+    index = words if isinstance(words, WordIndex) else WordIndex(words)
+    start = start or index[0]
+    if prune_words:
+        joinable = CrossingGraph(index).component(index.word_id(start))
+        if len(joinable) < len(index):
+            index = words = WordIndex([index[wid] for wid in joinable])
+    if cache_size:
+        index = words = PatternCache(index, cache_size)
+    if incumbent is not None:
+        incumbent.prepare(index)
+    if canonical and transpositions is None:
+        transpositions = TranspositionTable()
+    if copy_free:
+        encode = lambda node: pack_placements(node.placements(), index)
+        decode = lambda data: SearchNode.from_placements(unpack_placements(data, index))
+    else:
+        encode = lambda node: pack_placements(node.placements, index)
+        def decode(data):
+            node = Crossword2(grid_class)
+            node.replay(unpack_placements(data, index))
+            return node
+    if frontier is None:
+        if beam_width:
+            frontier = BeamFrontier(beam_width)
+        elif max_frontier:
+            frontier = SpillingFrontier(max_frontier, spill_dir, encode, decode)
+        else:
+            frontier = Frontier()
+    if state is not None:
+        restore_search(state, index, frontier, decode, transpositions, incumbent, grid_class)
+        work = Crossword2(grid_class) if copy_free else None
+    else:
+        root = Crossword2(grid_class)
+        root.embed((0, 0), HORIZONTAL, start)
+        if transpositions is not None:
+            transpositions.seen(root.layout_key())
+        if copy_free:
+            work = root
+            frontier.push(SearchNode.from_placements(root.placements), score=frontier.evaluate(root))
+        else:
+            work = None
+            frontier.push(root)
+    if checkpoint is not None:
+        checkpoint.attach(lambda: search_state(word_list, start, index, frontier, encode,
+                                               transpositions, incumbent))
+    if processes:
+        expansions = parallel_expansions(frontier, work, words, grid_class,
+                                         processes, batch_size or 4 * processes, deterministic,
+                                         budget, checkpoint)
+    else:
+        expansions = serial_expansions(frontier, work, index, stats, budget, incumbent,
+                                       checkpoint)
+    try:
+        for node, entry, base, valid, placements in expansions:
+            stats.count('nodes')
+            stats.frontier(len(frontier))
+            stats.tick()
+            if monitor:
+                print (frontier.report())
+                if transpositions is not None:
+                    print (transpositions.report())
+                if isinstance(monitor, dict):
+                    base.dump(empty=monitor['EMPTY'], filled=monitor['FILLED'])
+                else:
+                    base.dump()
+                print ('')
+            if valid and incumbent is not None:
+                incumbent.offer(base)
+            if placements is None:
+                # dead end; discard this base
+                stats.count('dead_ends')
+            elif not push_candidates(frontier, node, base, placements, copy_free, transpositions,
+                                     incumbent, stats, budget):
+                # the budget expired; a checkpoint expands the node again,
+                # so it is yielded then
+                frontier.requeue(node, entry)
+                continue
+            if valid:
+                stats.count('results')
+                yield base.copy() if copy_free else base
+    finally:
+        expansions.close()
+        frontier.close()
+        if checkpoint is not None:
+            checkpoint.detach()
+        stats.emit()
+
+
+def push_candidates(frontier, node, base, placements, copy_free, transpositions, incumbent, stats,
+                    budget=None):
+    u'''
+    Pushes the children of a node in build_crossword2, except the ones
+    the incumbent or the transpositions rule out.  If budget expires
+    first, none of them are pushed and False is returned.
     '''
-    crosswords = [Crossword2()]
-    crosswords[0].embed((0, 0), HORIZONTAL, words[0])
-    while True:
-        if not crosswords: break
-        crosswords = sorted(crosswords, key=lambda c: evaluate_crossword(c))
-        base = crosswords.pop(0)
-        if monitor:
-            print  ('%d candidates...'%(len(crosswords)))
-            if isinstance(monitor, dict):
-                base.dump(empty=monitor['EMPTY'], filled=monitor['FILLED'])
+    stats.count('candidates', len(placements))
+    children = []
+    keys = []
+    for p, d, w in placements:
+        if budget is not None and budget.expired():
+            if transpositions is not None:
+                transpositions.forget(keys)
+            return False
+        with stats.timer('copy'):
+            if copy_free:
+                candidate = base
             else:
-                base.dump()
-            print ('')
+                candidate = base.copy()
+            candidate.embed(p, d, w)
+        key = None if transpositions is None else candidate.layout_key()
+        if incumbent is not None and incumbent.hopeless(candidate):
+            stats.count('bounded')
+        elif key is not None and transpositions.seen(key):
+            stats.count('duplicates')
+        else:
+            if key is not None:
+                keys.append(key)
+            with stats.timer('scoring'):
+                score = frontier.evaluate(candidate)
+            children.append((SearchNode(node, p, d, w) if copy_free else candidate, score))
+        if copy_free:
+            with stats.timer('copy'):
+                base.undo()
+    for child, score in children:
+        frontier.push(child, score=score)
+    return True
+
+
+def expand_crossword(words, base, stats=None, budget=None):
+    '''
+    Returns whether base is a valid crossword and the placements which can
+    be embedded next, or None instead of the placements for a dead end.
+    Raises BudgetExpired when budget expires on the way.
+    '''
+    if stats is None:
+        stats = NULL_STATS
+    with stats.timer('sequences'):
+        sequences = base.all_disconnected_sequences()
+    valid = is_valid_crossword(sequences)
+    try:
+        return valid, generate_placements(words, base, sequences, stats, budget)
+    except ValueError:
+        return valid, None
+
+
+def serial_expansions(frontier, work, index, stats=None, budget=None, incumbent=None,
+                      checkpoint=None):
+    if stats is None:
+        stats = NULL_STATS
+    while frontier:
+        # the children of the last node are all pushed, so the frontier
+        # holds the whole search here
+        if checkpoint is not None and not checkpoint.tick():
+            break
+        if budget is not None:
+            if not budget.allow():
+                break
+            budget.spend()
+        node = frontier.pop()
+        entry = frontier.last
+        if work is None:
+            base = node
+        else:
+            with stats.timer('copy'):
+                work.replay(node.placements())
+            base = work
+        if incumbent is not None and incumbent.hopeless(base):
+            # the incumbent improved since this node was pushed
+            continue
         try:
-            sequences = base.all_disconnected_sequences()
-            if is_valid_crossword(sequences):
-                yield base
-            candidates = generate_candidates(words, base, sequences)
-            crosswords += candidates
-        except ValueError:
-            # discard this base
-            pass
+            valid, placements = expand_crossword(index, base, stats, budget)
+        except BudgetExpired:
+            frontier.requeue(node, entry)
+            break
+        yield node, entry, base, valid, placements
+    if checkpoint is not None and not checkpoint.requested:
+        checkpoint.save()
+
+
+_worker = {}
+
+
+def _init_worker(words, grid_class):
+    # a checkpoint of the parent may have caught SIGTERM, which
+    # pool.terminate sends to the workers
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _worker['index'] = words if isinstance(words, WordIndex) else WordIndex(words)
+    _worker['work'] = Crossword2(grid_class)
+
+
+def _expand_in_worker(task):
+    i, node = task
+    if isinstance(node, tuple):
+        base = _worker['work']
+        base.replay(node)
+    else:
+        base = node
+    valid, placements = expand_crossword(_worker['index'], base)
+    return i, valid, placements
+
+
+def parallel_expansions(frontier, work, words, grid_class, processes, batch_size, deterministic,
+                        budget=None, checkpoint=None):
+    u'''
+    Pops up to batch_size nodes at a time and expands them on a process
+    pool.  In deterministic mode the results are merged back in the order
+    the nodes were popped, so the search does not depend on timing;
+    otherwise they are merged as soon as each worker finishes.
+    '''
+    pool = multiprocessing.Pool(processes, _init_worker, (words, grid_class))
+    try:
+        imap = pool.imap if deterministic else pool.imap_unordered
+        while frontier:
+            if checkpoint is not None and not checkpoint.tick():
+                break
+            size = min(batch_size, len(frontier))
+            if budget is not None:
+                size = budget.allow(size)
+                if not size:
+                    break
+                budget.spend(size)
+            batch = [(frontier.pop(), frontier.last) for _ in range(size)]
+            if work is None:
+                tasks = [(i, node) for i, (node, _) in enumerate(batch)]
+            else:
+                # workers get the placements, not the chain of nodes
+                tasks = [(i, node.placements()) for i, (node, _) in enumerate(batch)]
+            chunksize = max(1, len(batch) // (4 * processes))
+            for i, valid, placements in imap(_expand_in_worker, tasks, chunksize):
+                node, entry = batch[i]
+                if work is None:
+                    base = node
+                else:
+                    work.replay(node.placements())
+                    base = work
+                yield node, entry, base, valid, placements
+        if checkpoint is not None and not checkpoint.requested:
+            checkpoint.save()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def is_valid_crossword(sequences):
     return all([len(s) <= 1 or s.find('.') > -1 for _, _, s in sequences])
 
 
-def generate_candidates(words, base, sequences):
+def generate_placements(words, base, sequences, stats=None, budget=None):
+    if stats is None:
+        stats = NULL_STATS
+    if not isinstance(words, WordIndex):
+        words = WordIndex(words)
+    used_words = set(base.used_words)
+    for _, _, s in sequences:
+        # a closed sequence no word matches is a dead end; find it before
+        # testing the placements of the other sequences
+        if len(s) > 1 and s.find('.') == -1 and not words.feasible(s, used_words):
+            raise ValueError('no candidates found')
     fit_words = []
     for sequence in sequences:
-        available_words = [w for w in words if w not in base.used_words]
-        fit_words_for_seq = [(p, d, w) for (p, d, w) in propose_words(sequence, available_words) if base.is_fit(p, d, w)]
+        if budget is not None and budget.expired():
+            raise BudgetExpired()
+        with stats.timer('proposal'):
+            proposed = words.propose(sequence, used_words)
+        fit_words_for_seq = []
+        with stats.timer('fit'):
+            for i, (p, d, w) in enumerate(proposed):
+                if (budget is not None and i and i % budget.CHECK_PROPOSALS == 0 and
+                        budget.expired()):
+                    raise BudgetExpired()
+                if base.is_fit(p, d, w):
+                    fit_words_for_seq.append((p, d, w))
+        stats.count('invalid', len(proposed) - len(fit_words_for_seq))
         _, _, s = sequence
         if not fit_words_for_seq and len(s) > 1 and s.find('.') == -1:
             # dead end; discard this base
             raise ValueError('no candidates found')
         fit_words += fit_words_for_seq
+    return fit_words
+
+
+def generate_candidates(words, base, sequences):
     candidates = []
-    for p, d, w in fit_words:
+    for p, d, w in generate_placements(words, base, sequences):
         copy = base.copy()
         copy.embed(p, d, w)
         candidates.append(copy)
@@ -231,6 +1397,8 @@ def generate_candidates(words, base, sequences):
 
 
 def propose_words(sequence, words):
+    if isinstance(words, WordIndex):
+        return words.propose(sequence)
     (p, d, seq) = sequence
     proposed_words = []
     for word in words:
@@ -244,22 +1412,313 @@ def propose_words(sequence, words):
 
 
 def evaluate_crossword(c):
-    # return -len(c.used_words)
     return (c.grid.width + c.grid.height) * 1.0 / len(c.used_words) ** 2
-    # return (c.grid.width * c.grid.height) * 1.0 / sum([len(w) for w in c.used_words])
 
 
-def pickup_crosswords(words, dump_option=None, monitor=False):
-    best = 9999
-    for c in build_crossword2(words, monitor=monitor):
-        if evaluate_crossword(c) < best:
+def evaluate_word_count(c):
+    return -len(c.used_words)
+
+
+def evaluate_density(c):
+    return (c.grid.width * c.grid.height) * 1.0 / sum([len(w) for w in c.used_words])
+
+
+# Optimistic bounds of the scores above: the best score any crossword
+# grown from c could get by adding the remaining words, which have
+# letters letters in total.  The covered area never shrinks.
+
+def bound_crossword(c, words, letters):
+    return (c.grid.width + c.grid.height) * 1.0 / (len(c.used_words) + words) ** 2
+
+
+def bound_word_count(c, words, letters):
+    return -(len(c.used_words) + words)
+
+
+def bound_density(c, words, letters):
+    return (c.grid.width * c.grid.height) * 1.0 / (sum([len(w) for w in c.used_words]) + letters)
+
+
+BOUNDS = {
+    evaluate_crossword: bound_crossword,
+    evaluate_word_count: bound_word_count,
+    evaluate_density: bound_density,
+}
+
+
+class Incumbent(object):
+    u'''
+    Best score found by a search, and the test whether a node can still
+    beat it.
+
+    bound(c, words, letters) gives the best score reachable from c when
+    the unused words (with letters letters in total) are added.  It
+    defaults to the bound of evaluate in BOUNDS; without one, nothing is
+    pruned.
+
+    >>> best = Incumbent(evaluate_word_count)
+    >>> best.prepare(['ANT', 'ART', 'RAT', 'TART'])
+    >>> c = Crossword2()
+    >>> c.embed((0, 0), HORIZONTAL, 'ANT')
+    >>> best.hopeless(c), best.offer(c), best.score
+    (False, True, -1)
+    >>> best.score = -4
+    >>> best.hopeless(c), best.pruned
+    (True, 1)
+    '''
+
+    def __init__(self, evaluate=None, bound=None):
+        self.evaluate = evaluate or evaluate_crossword
+        self.bound = bound or BOUNDS.get(self.evaluate)
+        self.score = None
+        self.crossword = None
+        self.pruned = 0
+        self.words = self.letters = 0
+
+    def prepare(self, words):
+        self.words = len(words)
+        self.letters = sum(len(w) for w in words)
+
+    def offer(self, c):
+        u'''
+        Takes c as the new incumbent if it scores better.
+        '''
+        score = self.evaluate(c)
+        if self.score is None or score < self.score:
+            self.score = score
+            self.crossword = c.copy()
+            return True
+        return False
+
+    def hopeless(self, c):
+        if self.score is None or self.bound is None:
+            return False
+        used = c.used_words
+        bound = self.bound(c, self.words - len(used),
+                           self.letters - sum([len(w) for w in used]))
+        if bound >= self.score:
+            self.pruned += 1
+            return True
+        return False
+
+    def report(self):
+        return 'best %s, %d nodes pruned'%(self.score, self.pruned)
+
+
+class SearchResult(object):
+    u'''
+    Outcome of search_crosswords: the best crosswords found, best first,
+    with their scores, and why the search stopped ('exhausted',
+    'deadline', 'node_budget', 'target' or 'terminated').
+    '''
+
+    def __init__(self, scored, nodes, elapsed, reason):
+        self.crosswords = [c for _, c in scored]
+        self.scores = [score for score, _ in scored]
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.reason = reason
+
+    def get_best(self):
+        return self.crosswords[0] if self.crosswords else None
+    best = property(get_best)
+
+    def get_best_score(self):
+        return self.scores[0] if self.scores else None
+    best_score = property(get_best_score)
+
+
+def search_crosswords(words, time_limit=None, node_budget=None, target_score=None, keep=1,
+                      evaluate=evaluate_crossword, **options):
+    u'''
+    Runs build_crossword2 until time_limit seconds have passed,
+    node_budget nodes are expanded, a crossword scores target_score or
+    better, or the search is exhausted, and returns the keep best
+    crosswords as a SearchResult.  The other options are passed to
+    build_crossword2; a search stopped by a signal to its checkpoint
+    ends with 'terminated'.
+
+    >>> result = search_crosswords(['ANT', 'ART', 'RAT'], keep=2)
+    >>> result.reason, result.nodes, result.scores
+    ('exhausted', 17, [1.2222222222222223, 1.2222222222222223])
+    >>> result.best.dump()
+    ___#_
+    _#_A_
+    _R_R_
+    #ANT#
+    _T_#_
+    _#___
+    >>> result = search_crosswords(['ANT', 'ART', 'RAT'], target_score=2.5)
+    >>> result.reason, result.nodes, result.best_score
+    ('target', 2, 2.5)
+    >>> search_crosswords(['ANT', 'ART', 'RAT'], node_budget=1).reason
+    'node_budget'
+    '''
+    started = time.time()
+    budget = SearchBudget(None if time_limit is None else started + time_limit, node_budget)
+    kept = []
+    counter = itertools.count()
+    reason = None
+    for c in build_crossword2(words, budget=budget, **options):
+        score = evaluate(c)
+        entry = (-score, -next(counter), c)
+        if len(kept) < keep:
+            heapq.heappush(kept, entry)
+        elif entry > kept[0]:
+            heapq.heapreplace(kept, entry)
+        if target_score is not None and score <= target_score:
+            reason = 'target'
+            break
+    scored = [(-score, c) for score, _, c in sorted(kept, reverse=True)]
+    checkpoint = options.get('checkpoint')
+    if reason is None and checkpoint is not None and checkpoint.requested:
+        reason = 'terminated'
+    return SearchResult(scored, budget.expanded, time.time() - started,
+                        reason or budget.reason or 'exhausted')
+
+
+class SharedIncumbent(Incumbent):
+    u'''
+    Incumbent whose score is a multiprocessing.Value shared by the
+    searches of a portfolio, so each prunes against the best of all.
+    The crossword is the best one of this search only.
+
+    >>> shared = multiprocessing.Value('d', float('inf'))
+    >>> a, b = SharedIncumbent(shared), SharedIncumbent(shared)
+    >>> a.score is None
+    True
+    >>> a.score = 2.0; b.score = 3.0
+    >>> a.score, b.score
+    (2.0, 2.0)
+    '''
+
+    def __init__(self, shared, evaluate=None, bound=None):
+        self.shared = shared
+        super(SharedIncumbent, self).__init__(evaluate, bound)
+
+    def get_score(self):
+        score = self.shared.value
+        return None if score == float('inf') else score
+
+    def set_score(self, score):
+        if score is None:
+            return
+        with self.shared.get_lock():
+            if score < self.shared.value:
+                self.shared.value = score
+
+    score = property(get_score, set_score)
+
+
+_portfolio = {}
+
+
+def _init_portfolio(words, best, cancel):
+    _portfolio['words'] = words
+    _portfolio['best'] = best
+    _portfolio['cancel'] = cancel
+
+
+def _portfolio_search(task):
+    seed, deadline, node_budget, target_score, evaluate, options = task
+    words = _portfolio['words']
+    rng = random.Random(seed)
+    if isinstance(words, WordIndex):
+        # an index keeps its order; start from a random word instead
+        start = words[rng.randrange(len(words))]
+    else:
+        words = list(words)
+        rng.shuffle(words)
+        start = words[0]
+    incumbent = SharedIncumbent(_portfolio['best'], evaluate)
+    budget = CancellableBudget(_portfolio['cancel'], deadline, node_budget)
+    best = None
+    reason = None
+    for c in build_crossword2(words, start=start, budget=budget, incumbent=incumbent, **options):
+        score = evaluate(c)
+        if best is None or score < best[0]:
+            best = (score, tuple(c.placements))
+        if target_score is not None and score <= target_score:
+            reason = 'target'
+            _portfolio['cancel'].set()
+            break
+    score, placements = best or (None, None)
+    return seed, start, score, placements, budget.expanded, reason or budget.reason or 'exhausted'
+
+
+def portfolio_crosswords(words, searches=4, processes=None, seed=None, time_limit=None,
+                         node_budget=None, target_score=None, keep=1,
+                         evaluate=evaluate_crossword, **options):
+    u'''
+    Runs searches independent build_crossword2 searches on a process
+    pool, each shuffling the words with its own seed and starting from
+    the first of them.  They share the best score for pruning, and once
+    one reaches target_score the others are cancelled.  time_limit and
+    node_budget apply to each search.  Returns a SearchResult of the best
+    crosswords of the searches, with runs listing (seed, start word,
+    score, expanded nodes, stop reason) of each.
+
+    >>> result = portfolio_crosswords(['ANT', 'ART', 'RAT'], searches=2, seed=1)
+    >>> result.reason, result.best_score, len(result.runs)
+    ('exhausted', 1.2222222222222223, 2)
+    >>> result = portfolio_crosswords(['ANT', 'ART', 'RAT'], searches=2, seed=1, target_score=3)
+    >>> result.reason, result.best_score <= 3
+    ('target', True)
+    '''
+    started = time.time()
+    rng = random.Random(seed)
+    seeds = [rng.randrange(2 ** 32) for _ in range(searches)]
+    deadline = None if time_limit is None else started + time_limit
+    best = multiprocessing.Value('d', float('inf'))
+    cancel = multiprocessing.Event()
+    tasks = [(s, deadline, node_budget, target_score, evaluate, options) for s in seeds]
+    pool = multiprocessing.Pool(processes or searches, _init_portfolio, (words, best, cancel))
+    try:
+        # a search reaching the target sets cancel, and the others stop
+        # after their current node and return what they have
+        runs = list(pool.imap_unordered(_portfolio_search, tasks))
+        pool.close()
+        pool.join()
+    finally:
+        pool.terminate()
+    grid_class = options.get('grid_class', OpenGrid)
+    scored = []
+    for _, _, score, placements, _, _ in sorted(runs, key=lambda run: (run[2] is None, run[2])):
+        if placements is not None and len(scored) < keep:
+            c = Crossword2(grid_class)
+            c.replay(placements)
+            scored.append((score, c))
+    reasons = [run[-1] for run in runs]
+    for reason in ('target', 'deadline', 'node_budget', 'exhausted'):
+        if reason in reasons:
+            break
+    result = SearchResult(scored, sum(run[4] for run in runs), time.time() - started, reason)
+    result.runs = [(s, start, score, nodes, r) for s, start, score, _, nodes, r in runs]
+    return result
+
+
+def pickup_crosswords(words, dump_option=None, monitor=False, copy_free=True, **options):
+    u'''
+    Runs build_crossword2 and shows each crossword which beats the best
+    score so far.  copy_free is on unless turned off, as it finds the
+    same crosswords in much less memory.
+    '''
+    best = Incumbent()
+    shown = None
+    for c in build_crossword2(words, monitor=monitor, incumbent=best, copy_free=copy_free,
+                              **options):
+        # every result is offered to the incumbent before it is yielded;
+        # after a resume, the best one may come from the checkpoint
+        if best.score != shown:
             if dump_option:
-                c.dump(empty=dump_option['EMPTY'], filled=dump_option['FILLED'])
+                best.crossword.dump(empty=dump_option['EMPTY'], filled=dump_option['FILLED'])
             else:
-                c.dump()
-            best = evaluate_crossword(c)
-            print ('score: %f'%(best))
+                best.crossword.dump()
+            shown = best.score
+            print ('score: %f'%(shown))
             print ('')
+    if monitor:
+        print (best.report())
 
 
 if __name__ == '__main__':
@@ -1,19 +1,66 @@
 # coding: utf-8
 
+import argparse
+import os
 import random
-import sys
 import re
-from codecs import open
 
 import crossword2
+from wordindex import CrossingGraph, WordIndex, load_words
 
-with open(sys.argv[1], encoding='utf-8') as f:
-    words = [s.strip() for s in f.readlines()]
+parser = argparse.ArgumentParser(description='generate crossword puzzles')
+parser.add_argument('words', help='word list file')
+parser.add_argument('--portfolio', type=int, metavar='N',
+                    help='run N searches from random start words on a process pool')
+parser.add_argument('--time-limit', type=float, help='seconds each portfolio search may run')
+parser.add_argument('--target', type=float, help='score which ends the portfolio')
+parser.add_argument('--checkpoint', metavar='FILE',
+                    help='save the search to FILE periodically and on SIGTERM')
+parser.add_argument('--checkpoint-interval', type=float, default=600.0,
+                    help='seconds between checkpoints')
+parser.add_argument('--connected-start', action='store_true',
+                    help='start from the word which crosses the most others')
+parser.add_argument('--resume', action='store_true',
+                    help='continue the search saved in the checkpoint file')
+args = parser.parse_args()
+
+if args.resume and args.checkpoint and os.path.exists(args.checkpoint):
+    # the checkpoint has the words in the order the search used them
+    words = crossword2.load_checkpoint(args.checkpoint)['words']
+    resume = args.checkpoint
+else:
+    words = load_words(args.words)
+    resume = None
 
 if re.match('^[A-Za-z]*$', words[0]):
     dump_option = {'EMPTY': '_', 'FILLED': '#'}
 else:
     dump_option = {'EMPTY': u'＿', 'FILLED': u'凸'}
 
-random.shuffle(words)
-crossword2.pickup_crosswords(words, dump_option=dump_option)
+if args.portfolio:
+    result = crossword2.portfolio_crosswords(words, searches=args.portfolio, copy_free=True,
+                                             time_limit=args.time_limit, target_score=args.target,
+                                             prune_words=True)
+    if result.best is not None:
+        result.best.dump(empty=dump_option['EMPTY'], filled=dump_option['FILLED'])
+        print ('score: %f'%(result.best_score))
+    for seed, start, score, nodes, reason in result.runs:
+        print ('%s: score %s, %d nodes, %s'%(start, score, nodes, reason))
+else:
+    if resume:
+        start = None
+    elif args.connected_start:
+        index = words if isinstance(words, WordIndex) else WordIndex(words)
+        start = index[CrossingGraph(index).by_connectivity()[0]]
+    elif isinstance(words, WordIndex):
+        # a compiled word list keeps its order; start from a random word instead
+        start = random.choice(words)
+    else:
+        random.shuffle(words)
+        start = None
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = crossword2.Checkpoint(args.checkpoint, args.checkpoint_interval)
+    # words which can never join the start word are dropped up front
+    crossword2.pickup_crosswords(words, dump_option=dump_option, start=start, prune_words=True,
+                                 checkpoint=checkpoint, resume=resume)
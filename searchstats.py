@@ -0,0 +1,153 @@
+# coding: utf-8
+
+import json
+import time
+
+
+class PhaseTimer(object):
+
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+        self.started = None
+
+    def __enter__(self):
+        self.started = self.stats.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.phase, self.stats.clock() - self.started)
+        return False
+
+
+class SearchStats(object):
+    u'''
+    Counters and phase timings of a search.
+
+    The generators take stats=None by default and then use NullStats,
+    which records nothing.  With a stream, a snapshot is written as a JSON
+    line every interval seconds, and once more when the search ends.
+
+    >>> now = [0]
+    >>> stats = SearchStats(clock=lambda: now[0])
+    >>> stats.count('nodes')
+    >>> stats.count('candidates', 3)
+    >>> with stats.timer('fit'): now[0] += 1
+    >>> stats.frontier(5); stats.frontier(2)
+    >>> snapshot = stats.snapshot()
+    >>> sorted(snapshot['counters'].items())
+    [('candidates', 3), ('nodes', 1)]
+    >>> snapshot['phases'], snapshot['frontier'], snapshot['max_frontier']
+    ({'fit': 1}, 2, 5)
+
+    >>> import io
+    >>> out = io.StringIO()
+    >>> stats = SearchStats(stream=out, interval=2, clock=lambda: now[0])
+    >>> for _ in range(5): now[0] += 1; stats.count('nodes'); stats.tick()
+    >>> [json.loads(line)['counters']['nodes'] for line in out.getvalue().splitlines()]
+    [2, 4]
+    '''
+
+    PHASES = ('sequences', 'proposal', 'fit', 'copy', 'scoring')
+
+    def __init__(self, stream=None, interval=10.0, clock=time.time):
+        self.stream = stream
+        self.interval = interval
+        self.clock = clock
+        self.counters = {}
+        self.phases = {}
+        self.timers = {}
+        self.frontier_size = 0
+        self.max_frontier_size = 0
+        self.started = self.last_emitted = clock()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def timer(self, phase):
+        if phase not in self.timers:
+            self.timers[phase] = PhaseTimer(self, phase)
+        return self.timers[phase]
+
+    def frontier(self, size):
+        self.frontier_size = size
+        if size > self.max_frontier_size:
+            self.max_frontier_size = size
+
+    def snapshot(self):
+        return {
+            'elapsed': self.clock() - self.started,
+            'counters': dict(self.counters),
+            'phases': dict(self.phases),
+            'frontier': self.frontier_size,
+            'max_frontier': self.max_frontier_size,
+        }
+
+    def tick(self):
+        if self.stream is not None and self.clock() - self.last_emitted >= self.interval:
+            self.emit()
+
+    def emit(self):
+        self.last_emitted = self.clock()
+        if self.stream is not None:
+            line = json.dumps(self.snapshot(), sort_keys=True)
+            if isinstance(line, bytes):
+                # Python 2; io streams take text only
+                line = line.decode('ascii')
+            self.stream.write(line + u'\n')
+            self.stream.flush()
+
+    def report(self):
+        counters = ', '.join('%s %d'%(k, v) for k, v in sorted(self.counters.items()))
+        phases = ', '.join('%s %.3fs'%(k, self.phases[k]) for k in self.PHASES if k in self.phases)
+        return '%s; %s; frontier %d (max %d)'%(counters, phases,
+                                               self.frontier_size, self.max_frontier_size)
+
+
+class NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullStats(object):
+    u'''
+    Stands in for SearchStats when a search is not measured, so that the
+    generators run the same loop either way.  Nothing is recorded.
+
+    >>> stats = NullStats()
+    >>> stats.count('nodes')
+    >>> with stats.timer('fit'): pass
+    >>> stats.frontier(5); stats.tick(); stats.emit()
+    '''
+
+    TIMER = NullTimer()
+
+    def count(self, name, n=1):
+        pass
+
+    def timer(self, phase):
+        return self.TIMER
+
+    def frontier(self, size):
+        pass
+
+    def tick(self):
+        pass
+
+    def emit(self):
+        pass
+
+
+NULL_STATS = NullStats()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
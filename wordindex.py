@@ -0,0 +1,436 @@
+# coding: utf-8
+
+import json
+import mmap
+import struct
+import sys
+import unicodedata
+from array import array
+from codecs import open
+from collections import OrderedDict
+
+from crossword import OpenGrid
+
+MAGIC = b'CWINDEX1'
+
+
+class WordIndex(object):
+    u'''
+    Positional letter index over a word list.
+
+    For every letter the index keeps the postings (word id, position)
+    in word order, so a dotted pattern like 'TI.E' is answered by walking
+    the shortest postings list and probing the other letters instead of
+    scanning every word.
+
+    >>> index = WordIndex(['ANT', 'ART', 'RAT', 'TART'])
+    >>> index.matches('T')
+    [(0, 2), (1, 2), (2, 2), (3, 0), (3, 3)]
+    >>> index.matches('A.T')
+    [(0, 0), (1, 0), (3, 1)]
+    >>> index.propose(((0, 0), 2, 'R.'), used_words=set(['ART']))
+    [((0, 0), 2, 'RAT'), ((0, -2), 2, 'TART')]
+
+    Any letters can be indexed.
+    >>> index = WordIndex([u'すくらむ', u'らむね'])
+    >>> index.matches(u'らむ')
+    [(0, 2), (1, 0)]
+    '''
+
+    def __init__(self, words):
+        self.words = list(words)
+        self._ids = None
+        self._postings = {}
+        for wid, word in enumerate(self.words):
+            for pos, letter in enumerate(word):
+                wids, positions = self._postings.setdefault(letter, ([], []))
+                wids.append(wid)
+                positions.append(pos)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __getitem__(self, wid):
+        return self.words[wid]
+
+    def word_id(self, word):
+        if self._ids is None:
+            self._ids = dict((w, i) for i, w in reversed(list(enumerate(self))))
+        return self._ids[word]
+
+    def postings(self, letter):
+        return self._postings.get(letter, ((), ()))
+
+    def letters(self):
+        return sorted(self._postings)
+
+    def words_of_length(self, length):
+        u'''
+        Ids of the words with the given length, in word order.
+        '''
+        return [wid for wid, word in enumerate(self.words) if len(word) == length]
+
+    def matches(self, pattern):
+        u'''
+        Returns (word id, offset) of every place a word matches the
+        pattern, where '.' stands for any letter.  The order is the same
+        as scanning the words from the top with the offsets ascending.
+        '''
+        length = len(pattern)
+        letters = [(k, l) for k, l in enumerate(pattern) if l != '.']
+        words = self.words
+        if not letters:
+            return [(wid, o)
+                    for wid, word in enumerate(words)
+                    for o in range(len(word) - length + 1)]
+        driver = min(letters, key=lambda kl: len(self.postings(kl[1])[0]))
+        others = [kl for kl in letters if kl is not driver]
+        k0, l0 = driver
+        results = []
+        for wid, pos in zip(*self.postings(l0)):
+            offset = pos - k0
+            if offset < 0: continue
+            word = words[wid]
+            if offset + length > len(word): continue
+            for k, l in others:
+                if word[offset + k] != l: break
+            else:
+                results.append((wid, offset))
+        return results
+
+    def propose(self, sequence, used_words=()):
+        (p, d, seq) = sequence
+        words = self.words
+        return [(OpenGrid.pos_inc(p, -offset, d), d, words[wid])
+                for wid, offset in self.matches(seq)
+                if words[wid] not in used_words]
+
+    def feasible(self, pattern, used_words=()):
+        u'''
+        Whether any word not in used_words matches the pattern.
+        '''
+        words = self.words
+        for wid, _ in self.matches(pattern):
+            if words[wid] not in used_words:
+                return True
+        return False
+
+
+class PatternCache(WordIndex):
+    u'''
+    WordIndex remembering the matches of the last maxsize patterns.  The
+    search asks for the same few patterns at most nodes, and only the
+    used words differ from node to node, so those are filtered per call.
+
+    >>> cache = PatternCache(WordIndex(['ANT', 'ART', 'RAT', 'TART']), maxsize=2)
+    >>> cache.matches('A.T')
+    [(0, 0), (1, 0), (3, 1)]
+    >>> cache.propose(((0, 0), 2, 'A.T'), used_words=set(['ANT']))
+    [((0, 0), 2, 'ART'), ((0, -1), 2, 'TART')]
+    >>> cache.feasible('RT', set(['ART'])), cache.feasible('RT', set(['ART', 'TART']))
+    (True, False)
+    >>> cache.hits, cache.misses
+    (2, 2)
+    >>> cache.matches('T'), cache.matches('R'), len(cache.cache)
+    ([(0, 2), (1, 2), (2, 2), (3, 0), (3, 3)], [(1, 1), (2, 0), (3, 2)], 2)
+    >>> 'A.T' in cache.cache
+    False
+    '''
+
+    def __init__(self, index, maxsize=4096):
+        self.index = index
+        self.words = index.words
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __reduce__(self):
+        return (PatternCache, (self.index, self.maxsize))
+
+    def word_id(self, word):
+        return self.index.word_id(word)
+
+    def postings(self, letter):
+        return self.index.postings(letter)
+
+    def letters(self):
+        return self.index.letters()
+
+    def words_of_length(self, length):
+        return self.index.words_of_length(length)
+
+    def matches(self, pattern):
+        cache = self.cache
+        if pattern in cache:
+            self.hits += 1
+            result = cache.pop(pattern)
+            cache[pattern] = result
+            return result
+        self.misses += 1
+        result = cache[pattern] = self.index.matches(pattern)
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False)
+        return result
+
+    def report(self):
+        return '%d patterns cached, %d hits, %d misses'%(len(self.cache), self.hits, self.misses)
+
+
+class CrossingGraph(object):
+    u'''
+    Which words can cross which.  Two words cross where they share a
+    letter, so the crossings are counted and followed through the letter
+    postings of the index rather than stored.
+
+    >>> graph = CrossingGraph(WordIndex(['ANT', 'ART', 'RAT', 'OX', 'XO']))
+    >>> [graph.degree(wid) for wid in range(5)]
+    [4, 5, 5, 2, 2]
+    >>> graph.by_connectivity()
+    [1, 2, 0, 3, 4]
+    >>> sorted(graph.component(0)), sorted(graph.component(4))
+    ([0, 1, 2], [3, 4])
+    '''
+
+    def __init__(self, index):
+        self.index = index
+
+    def degree(self, wid):
+        u'''
+        Number of ways other words can cross the word wid.
+        '''
+        word = self.index[wid]
+        return sum(len(self.index.postings(letter)[0]) for letter in word) - sum(
+            word.count(letter) for letter in word)
+
+    def by_connectivity(self, wids=None):
+        u'''
+        Word ids, the words which cross the most others first.
+        '''
+        if wids is None:
+            wids = range(len(self.index))
+        return sorted(wids, key=lambda wid: -self.degree(wid))
+
+    def component(self, wid):
+        u'''
+        Ids of the words connected to the word wid through chains of
+        crossings, which are the only ones a search started from it can
+        ever place.
+        '''
+        members = set([wid])
+        letters = set()
+        pending = set(self.index[wid])
+        while pending:
+            letters |= pending
+            found = set()
+            for letter in pending:
+                for other in self.index.postings(letter)[0]:
+                    if other not in members:
+                        members.add(other)
+                        found.update(self.index[other])
+            pending = found - letters
+        return sorted(members)
+
+
+def normalize_words(lines):
+    u'''
+    Strips, NFC-normalizes and deduplicates words, keeping their order.
+
+    >>> print (' '.join(normalize_words([u' ANT', u'ART\\n', u'', u'ANT'])))
+    ANT ART
+    '''
+    words = []
+    seen = set()
+    for line in lines:
+        word = unicodedata.normalize('NFC', line.strip())
+        if word and word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def array_bytes(values):
+    try:
+        return values.tobytes()
+    except AttributeError:
+        # Python 2
+        return values.tostring()
+
+
+def compile_words(words, path):
+    u'''
+    Writes a compiled word list: the words, their ids bucketed by length
+    and the letter postings of WordIndex, laid out as arrays so that
+    load_words can map the file instead of parsing it.
+    '''
+    index = WordIndex(normalize_words(words))
+    sections = []
+    header = {'byteorder': sys.byteorder, 'count': len(index)}
+
+    def add(name, data):
+        header[name] = [sum(len(d) for d in sections), len(data)]
+        sections.append(data + b'\0' * (-len(data) % 4))
+
+    encoded = [w.encode('utf-8') for w in index.words]
+    offsets = array('I', [0])
+    for word in encoded:
+        offsets.append(offsets[-1] + len(word))
+    add('offsets', array_bytes(offsets))
+    add('text', b''.join(encoded))
+    by_length = {}
+    for wid, word in enumerate(index.words):
+        by_length.setdefault(len(word), []).append(wid)
+    lengths = array('I')
+    header['lengths'] = {}
+    for length in sorted(by_length):
+        header['lengths'][length] = [len(lengths), len(by_length[length])]
+        lengths.extend(by_length[length])
+    add('length_ids', array_bytes(lengths))
+    wids, positions = array('I'), array('I')
+    header['letters'] = {}
+    for letter in index.letters():
+        letter_wids, letter_positions = index.postings(letter)
+        header['letters'][letter] = [len(wids), len(letter_wids)]
+        wids.extend(letter_wids)
+        positions.extend(letter_positions)
+    add('wids', array_bytes(wids))
+    add('positions', array_bytes(positions))
+    encoded_header = json.dumps(header).encode('utf-8')
+    encoded_header += b' ' * (-len(encoded_header) % 4)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(encoded_header)))
+        f.write(encoded_header)
+        for data in sections:
+            f.write(data)
+
+
+class CompiledWords(object):
+    u'''
+    Read-only sequence of the words in a compiled word list.
+    '''
+
+    def __init__(self, offsets, text):
+        self.offsets = offsets
+        self.text = text
+        self.decoded = [None] * (len(offsets) - 1)
+
+    def __len__(self):
+        return len(self.decoded)
+
+    def __getitem__(self, wid):
+        word = self.decoded[wid]
+        if word is None:
+            word = bytes(self.text[self.offsets[wid]:self.offsets[wid + 1]]).decode('utf-8')
+            self.decoded[wid] = word
+        return word
+
+    def __iter__(self):
+        for wid in range(len(self)):
+            yield self[wid]
+
+
+class CompiledWordIndex(WordIndex):
+    u'''
+    WordIndex over a memory-mapped compiled word list.  Nothing is parsed
+    up front; words are decoded and postings copied out on first use.
+
+    >>> import os, tempfile
+    >>> fd, path = tempfile.mkstemp()
+    >>> os.close(fd)
+    >>> compile_words([u'ANT', u'ART', u'RAT', u'ANT', u'TART'], path)
+    >>> index = load_words(path)
+    >>> print ('%d %s' % (len(index), index[3]))
+    4 TART
+    >>> index.matches('A.T') == [(0, 0), (1, 0), (3, 1)]
+    True
+    >>> index.words_of_length(3) == [0, 1, 2]
+    True
+    >>> index.close()
+    >>> os.remove(path)
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(self.map)
+        except TypeError:
+            # Python 2 maps have no buffer interface; slices are copies
+            view = self.map
+        size, = struct.unpack('<I', view[len(MAGIC):len(MAGIC) + 4])
+        start = len(MAGIC) + 4
+        self.header = header = json.loads(bytes(view[start:start + size]).decode('utf-8'))
+        body = view[start + size:]
+
+        def section(name, fmt=None):
+            offset, length = header[name]
+            data = body[offset:offset + length]
+            if fmt is None:
+                return data
+            if header['byteorder'] == sys.byteorder and hasattr(data, 'cast'):
+                return data.cast(fmt)
+            values = array(fmt, bytes(data))
+            if header['byteorder'] != sys.byteorder:
+                values.byteswap()
+            return values
+
+        self.words = CompiledWords(section('offsets', 'I'), section('text'))
+        self.length_ids = section('length_ids', 'I')
+        self.wids = section('wids', 'I')
+        self.positions = section('positions', 'I')
+        self._ids = None
+        self._postings = {}
+
+    def __reduce__(self):
+        return (load_words, (self.path,))
+
+    def postings(self, letter):
+        if letter not in self._postings:
+            if letter not in self.header['letters']:
+                return ((), ())
+            start, count = self.header['letters'][letter]
+            # lists iterate faster than the mapped arrays
+            self._postings[letter] = (self.wids[start:start + count].tolist(),
+                                      self.positions[start:start + count].tolist())
+        return self._postings[letter]
+
+    def letters(self):
+        return sorted(self.header['letters'])
+
+    def words_of_length(self, length):
+        if str(length) not in self.header['lengths']:
+            return []
+        start, count = self.header['lengths'][str(length)]
+        return list(self.length_ids[start:start + count])
+
+    def close(self):
+        self._postings = {}
+        self.words = self.length_ids = self.wids = self.positions = None
+        self.map.close()
+        self.file.close()
+
+
+def is_compiled(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_words(path):
+    u'''
+    Loads a word list file.  A compiled word list is mapped and returned
+    as a CompiledWordIndex; a text file is returned as a list of words.
+    '''
+    if is_compiled(path):
+        return CompiledWordIndex(path)
+    with open(path, encoding='utf-8') as f:
+        return [s.strip() for s in f.readlines()]
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()